@@ -0,0 +1,5 @@
+"""
+# Pyccoon benchmarks
+
+Timings of the main documentation phases on a synthetic corpus, see [[bench.py]].
+"""
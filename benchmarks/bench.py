@@ -0,0 +1,266 @@
+"""
+## Benchmarks
+
+Times the documentation phases separately on the synthetic [[corpus.py]]:
+
+parse:      `Language.parse`
+highlight:  `Pyccoon.highlight`, i.e. Pygments and the docs conversion of all the sections
+markdown:   `Language.markdown` of the docs alone
+render:     `Pyccoon.generate_html`
+
+The `startup` sample times new interpreters instead, Python's own startup included:
+
+import:     `import pyccoon.pyccoon`
+version:    `pyccoon --version`
+
+Every phase is run a few times, the best and the median times are kept. Usage:
+
+```bash
+python -m benchmarks.bench run -o before.json
+python -m benchmarks.bench run -o after.json
+python -m benchmarks.bench compare before.json after.json
+```
+
+`compare` exits with the status `1` when some phase got slower than the threshold allows.
+
+Timings are noisy: two runs of the same code on a busy machine easily differ by 30% or more,\
+short phases the most. So a phase is only reported as slower when:
+
+- its best time grew by more than the threshold plus the spread of the timings, i.e. by how\
+  much the median exceeded the best time in either run, and
+- by at least `--min-delta` (default 5ms) in absolute terms.
+
+With a single repetition (`-r 1`) there's no spread to go by, keep the default of 5 or more\
+repetitions and run both sides on an otherwise idle machine.
+"""
+
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from io import open
+
+from pyccoon import __version__
+from pyccoon.cache import MemoCache
+from pyccoon.pyccoon import Pyccoon
+
+from .corpus import corpus, sizes
+
+phases = ['parse', 'highlight', 'markdown', 'render']
+startup_phases = ['import', 'version']
+
+
+def timings(function, repeat, setup=None):
+    """ The best and the median of `repeat` timings of `function(setup())` """
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = timeit.default_timer()
+        function(argument)
+        times.append(timeit.default_timer() - start)
+    times.sort()
+    middle = len(times) // 2
+    median = times[middle] if len(times) % 2 else (times[middle - 1] + times[middle]) / 2
+    return {'min': times[0], 'median': median}
+
+
+def measure(pyccoon, source, code, repeat):
+    """ Time all the phases on a single source """
+    language = pyccoon.get_language(source)
+
+    def parse(_=None):
+        return language.parse(code, add_lineno=pyccoon.add_lineno)
+
+    def highlighted(_=None):
+        sections = parse()
+        pyccoon.highlight(source, sections, language)
+        return sections
+
+    def uncached(_=None):
+        # Every repetition converts the docs and highlights the code again, rather than timing
+        # the lookups of the caches filled by the previous one
+        pyccoon.docs_cache = MemoCache()
+        pyccoon.highlight_cache = None
+        return parse()
+
+    docs = [section['docs_text'] for section in parse()]
+    sections = highlighted()
+
+    return {
+        'parse': timings(parse, repeat),
+        'highlight': timings(lambda sections: pyccoon.highlight(source, sections, language),
+                             repeat, setup=uncached),
+        'markdown': timings(lambda _: [language.markdown(text) for text in docs], repeat),
+        'render': timings(lambda _: pyccoon.generate_html(source, sections), repeat),
+        'sections': len(sections),
+        'bytes': len(code.encode('utf8')),
+    }
+
+
+def measure_startup(repeat):
+    """ Time starting up new interpreters """
+    commands = {
+        'import': [sys.executable, '-c', 'import pyccoon.pyccoon'],
+        'version': [sys.executable, '-m', 'pyccoon.pyccoon', '--version'],
+    }
+    with open(os.devnull, 'w') as devnull:
+        return dict(
+            (phase, timings(lambda _: subprocess.check_call(command, stdout=devnull), repeat))
+            for phase, command in commands.items())
+
+
+def run(options):
+    folder = tempfile.mkdtemp()
+    try:
+        samples = list(corpus(options.sizes))
+        for name, filename, code in samples:
+            with open(os.path.join(folder, filename), 'w', encoding='utf8') as f:
+                f.write(code)
+
+        pyccoon = Pyccoon({
+            'sourcedir': folder,
+            'outdir': os.path.join(folder, 'docs'),
+            'config_file': os.path.join(folder, '.pyccoon.yaml'),
+            'verbosity': 0,
+        }, process=False)
+
+        results = {}
+        for name, filename, code in samples:
+            if options.filter and options.filter not in name:
+                continue
+            results[name] = measure(pyccoon, filename, code, options.repeat)
+            print("{0:30s}".format(name) +
+                  "".join("{0:>12s}".format(format_time(results[name][phase]['min']))
+                          for phase in phases))
+    finally:
+        shutil.rmtree(folder)
+
+    if not options.filter or options.filter == 'startup':
+        results['startup'] = measure_startup(options.repeat)
+        print("{0:30s}".format('startup') +
+              "".join("{0:>12s}".format(format_time(results['startup'][phase]['min']))
+                      for phase in startup_phases))
+
+    data = {
+        'meta': {
+            'pyccoon': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.now().isoformat(),
+            'repeat': options.repeat,
+        },
+        'results': results,
+    }
+    with open(options.output, 'w', encoding='utf8') as f:
+        f.write(json.dumps(data, sort_keys=True, indent=1, ensure_ascii=False))
+    print("\nSaved to {0}".format(options.output))
+
+
+def spread(timing):
+    """
+    The best time of a phase and by how much the median exceeded it, relative to it. Results\
+    saved before the medians were recorded are a plain best time.
+    """
+    if not isinstance(timing, dict):
+        return timing, 0
+    best = timing['min']
+    return best, (timing['median'] - best) / best if best else 0
+
+
+def compare(old, new, threshold, min_delta=0.005):
+    """
+    Print the timings of two runs side by side. Returns the list of `(sample, phase, ratio)`\
+    regressions, phases that got slower by more than the `threshold` (e.g. `0.1` for 10%) and\
+    the spread of their timings, and by at least `min_delta` seconds.
+    """
+    regressions = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        for phase in phases + startup_phases:
+            if phase not in old['results'][name] or phase not in new['results'][name]:
+                continue
+            before, old_spread = spread(old['results'][name][phase])
+            after, new_spread = spread(new['results'][name][phase])
+            if not before:
+                continue
+
+            ratio = after / before
+            noise = max(old_spread, new_spread)
+            flag = ''
+            if ratio > 1 + threshold + noise and after - before >= min_delta:
+                regressions.append((name, phase, ratio))
+                flag = '  <-- slower'
+            elif ratio < 1 - threshold - noise and before - after >= min_delta:
+                flag = '  faster'
+            print("{0:30s}{1:>10s}{2:>12s}{3:>12s}{4:>8.2f}x{5:>8s}{6}".format(
+                name, phase, format_time(before), format_time(after), ratio,
+                "+-{0:.0f}%".format(noise * 100), flag))
+
+    if min(old['meta'].get('repeat', 1), new['meta'].get('repeat', 1)) < 3:
+        print("\nFewer than 3 repetitions, the timings have no spread to tell the noise by")
+    missing = set(old['results']) ^ set(new['results'])
+    if missing:
+        print("\nOnly in one of the runs: " + ", ".join(sorted(missing)))
+    return regressions
+
+
+def format_time(seconds):
+    if seconds >= 1:
+        return "{0:.2f}s".format(seconds)
+    return "{0:.2f}ms".format(seconds * 1000)
+
+
+def load(path):
+    with open(path, encoding='utf8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage="%prog run [options]\n       %prog compare OLD.json NEW.json [options]")
+    parser.add_option('-o', '--output', action='store', dest='output',
+                      default='benchmarks.json',
+                      help='Results file of `run` (default: `%default`)')
+    parser.add_option('-r', '--repeat', action='store', dest='repeat', default=5, type='int',
+                      help='Timings per phase, the best and the median are kept '
+                           '(default: %default)')
+    parser.add_option('-s', '--size', action='append', dest='sizes',
+                      choices=sorted(sizes),
+                      help='Corpus sizes to run ({0}; default: all)'.format(
+                          ", ".join(sorted(sizes, key=sizes.get))))
+    parser.add_option('-k', '--filter', action='store', dest='filter',
+                      help='Only run the samples with the names containing this string')
+    parser.add_option('-t', '--threshold', action='store', dest='threshold',
+                      default=0.1, type='float',
+                      help='Slowdown that `compare` reports as a regression, on top of the '
+                           'spread of the timings (default: %default)')
+    parser.add_option('-d', '--min-delta', action='store', dest='min_delta',
+                      default=0.005, type='float',
+                      help='Smallest slowdown in seconds that `compare` reports '
+                           '(default: %default)')
+
+    options, args = parser.parse_args(argv)
+    command = args[0] if args else 'run'
+
+    if command == 'run':
+        run(options)
+    elif command == 'compare' and len(args) == 3:
+        regressions = compare(load(args[1]), load(args[2]), options.threshold,
+                              options.min_delta)
+        if regressions:
+            print("\n{0:d} regressions".format(len(regressions)))
+            return 1
+    else:
+        parser.error("unknown command")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
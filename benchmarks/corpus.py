@@ -0,0 +1,164 @@
+"""
+## Synthetic corpus
+
+Generates sources of every registered language, made of the same "unit" (a documented\
+function or class) repeated as many times as needed, plus a few pathological inputs.
+"""
+
+from pyccoon.languages import languages
+
+# The sizes of the regular samples, in units
+sizes = {
+    'small': 10,
+    'medium': 100,
+    'large': 1000,
+}
+
+# A unit of code of each language, formatted with its number `n`. Comments are written with\
+# `{inline}` and `{start}`/`{end}` and filled in from the language definition.
+units = {
+    'Markdown': (
+        "## Section {n}\n\n"
+        "Some *text* with `code` and a [link](http://example.com/{n}).\n\n"
+        "- item {n}\n- another item\n\n"
+        "```python\nx = {n}\n```\n\n"
+    ),
+    'Python': (
+        "{inline} ## Function {n}\n"
+        "{inline} Computes *something* for `x`.\n"
+        "def function_{n}(x, y=None):\n"
+        "    {start}\n    Docstring of the function {n}.\n\n    :param x: Argument\n    {end}\n"
+        "    if x > {n}:\n"
+        "        return [i * 2 for i in range(x)]\n"
+        "    return None\n\n\n"
+        "@decorator\n"
+        "class Class{n}(object):\n"
+        "    {inline} Method docs\n"
+        "    def method(self):\n"
+        "        return {n}\n\n\n"
+    ),
+    'C': (
+        "{start} Function {n}\n * Computes *something*. {end}\n"
+        "int function_{n}(int x) {{\n"
+        "    {inline} Loop over things\n"
+        "    for (int i = 0; i < x; i++) {{\n"
+        "        x += i * {n};\n"
+        "    }}\n"
+        "    return x;\n"
+        "}}\n\n"
+    ),
+    'JavaScript': (
+        "{inline} ## Function {n}\n"
+        "{inline} Computes *something*.\n"
+        "function function_{n}(x) {{\n"
+        "    var result = [];\n"
+        "    for (var i = 0; i < x; i++) {{ result.push(i * {n}); }}\n"
+        "    return result;\n"
+        "}}\n\n"
+        "{start} Class {n} {end}\n"
+        "class Class{n} {{\n"
+        "    method() {{ return {n}; }}\n"
+        "}}\n\n"
+    ),
+    'PHP': (
+        "{inline} ## Function {n}\n"
+        "function function_{n}($x) {{\n"
+        "    {inline} Loop over things\n"
+        "    foreach ($x as $i) {{ echo $i * {n}; }}\n"
+        "    return $x;\n"
+        "}}\n\n"
+        "{start}\n * Class {n}\n {end}\n"
+        "class Class{n} {{\n"
+        "    public function method() {{ return {n}; }}\n"
+        "}}\n\n"
+    ),
+    'Ruby': (
+        "{inline} ## Module {n}\n"
+        "module Module{n}\n"
+        "  {inline} Class docs\n"
+        "  class Class{n}\n"
+        "    {inline} Method docs\n"
+        "    def method(x)\n"
+        "      x.map {{ |i| i * {n} }}\n"
+        "    end\n"
+        "  end\n"
+        "end\n\n"
+        "{start}\nBlock comment {n}\n{end}\n\n"
+    ),
+    'Fortran': (
+        "{inline} Subroutine {n}\n"
+        "subroutine sub_{n}(x)\n"
+        "  integer :: x\n"
+        "  x = x * {n}\n"
+        "end subroutine\n\n"
+    ),
+    'CoffeeScript': (
+        "{inline}## Class {n}\n"
+        "class Class{n}\n"
+        "  {inline}Method docs\n"
+        "  method: (x) ->\n"
+        "    (i * {n} for i in x)\n\n"
+        "{start}\nBlock comment {n}\n{end}\n\n"
+    ),
+    'Haskell': (
+        "{inline} | Function {n}\n"
+        "{inline} Computes /something/ for @x@.\n"
+        "function{n} :: Int -> Int\n"
+        "function{n} x = x * {n}\n\n"
+        "{start} Block comment {n} {end}\n\n"
+    ),
+}
+
+# File names of the samples by language
+extensions = dict((language.__name__, language.extensions[0]) for language in languages)
+
+
+def delimiters(language):
+    """ Comment delimiters of the `language`, as the format arguments of its unit """
+    start = getattr(language, 'multistart', '')
+    end = getattr(language, 'multiend', '')
+    # Some delimiters are regular expressions
+    for regex, text in ((r"/\*+", "/*"), (r"\*+/", "*/"), (r"^[Cc]", "C"), (r"$", "")):
+        start = text if start == regex else start
+        end = text if end == regex else end
+    return {
+        'inline': getattr(language, 'inline_delimiter', '#').strip() + ' ',
+        'start': start,
+        'end': end,
+    }
+
+
+def generate(name, count):
+    """ Source of the language `name` made of `count` units """
+    language = next(language for language in languages if language.__name__ == name)
+    unit = units[name]
+    arguments = delimiters(language)
+    return "".join(unit.format(n=n, **arguments) for n in range(count))
+
+
+def pathological():
+    """ Inputs that used to be slow to handle: `(name, filename, code)` tuples """
+    yield ('huge-comment', 'huge_comment.py',
+           "".join("# Line {0} of a *very* long comment with `code`\n".format(n)
+                   for n in range(1000)) + "x = 1\n")
+    yield ('huge-docstring', 'huge_docstring.py',
+           'def f():\n    """\n' +
+           "".join("    Line {0} of a long docstring\n".format(n) for n in range(5000)) +
+           '    """\n')
+    yield ('decorators', 'decorators.py',
+           "".join("@decorator_{0}\ndef function_{0}():\n    pass\n\n".format(n)
+                   for n in range(1000)))
+    yield ('long-lines', 'long_lines.c',
+           "".join("int x{0} = {1};\n".format(n, " + ".join(["1"] * 500)) for n in range(200)))
+
+
+def corpus(selected_sizes=None):
+    """ All the samples: `(name, filename, code)` tuples """
+    for size, count in sorted(sizes.items(), key=lambda item: item[1]):
+        if selected_sizes and size not in selected_sizes:
+            continue
+        for name in sorted(units):
+            yield ('{0}/{1}'.format(name, size), 'sample_{0}{1}'.format(size, extensions[name]),
+                   generate(name, count))
+    for sample in pathological():
+        yield sample
@@ -0,0 +1,129 @@
+"""
+## Rendering API
+
+Documents source text in process, for editors, previews and web servers: nothing is read from\
+or written to the disk.
+
+    from pyccoon.api import Renderer
+
+    renderer = Renderer(project_name="Example")
+    html = renderer.page(code, path="example/module.py")
+    sections = renderer.sections(code, path="example/module.py")
+
+A `Renderer` is meant to be created once and kept: the languages, Pygments lexers, Markdown\
+engines and the compiled page template stay warm between the calls, and the docs converted\
+once (see `Pyccoon.convert_docs`) are not converted again. It can be shared between threads.
+"""
+
+import os
+import threading
+
+from .cache import MemoCache
+from .languages import get_language
+from .pyccoon import Pyccoon
+from .utils import DependencyGraph, SourceRecord
+from .xref import CrossReferences
+
+
+class DetachedPyccoon(Pyccoon):
+    """
+    `Pyccoon` that knows only the sources it is given. Any other file it is asked about, e.g. the\
+    target of a cross-reference, is as good as missing, and its language is told by its name.
+    """
+
+    def record(self, source):
+        source = os.path.normpath(source)
+        record = self.records.get(source)
+        if record is None:
+            record = SourceRecord(source, os.path.join(self.sourcedir, source),
+                                  self.detect_language)
+            record.isfile = False
+            record.language = get_language(source, None)
+        return record
+
+    def add(self, source, code, language):
+        """ Add the in-memory `code` of the `source` """
+        record = SourceRecord(source, os.path.join(self.sourcedir, source), self.detect_language)
+        record.code = code
+        record.isfile = True
+        record.language = language
+        self.records[source] = record
+
+    def remove(self, source):
+        """ Forget the `source` and everything learned while rendering it """
+        self.records.pop(source, None)
+        self.sections = None
+        self.dependencies = DependencyGraph()
+        self.references = CrossReferences()
+
+
+class Renderer(object):
+    """
+    ### Renderer
+    Turns source text into documentation sections or a whole page.
+
+    :param project_name: Name shown in the page titles
+    :param options: Other `Pyccoon` options, e.g. `config_file` (which is not read by default),\
+        or `build_time` to date all the pages by. Otherwise every page is dated by the time it\
+        is rendered, or by `SOURCE_DATE_EPOCH` (see `Pyccoon.timestamp`).
+    """
+
+    # The pages are rendered as if the sources and the docs were both in the root folder
+    root = os.sep
+    untitled = 'untitled'
+
+    def __init__(self, project_name=None, **options):
+        self.project_name = project_name
+        self.options = dict(options, config_file=options.get('config_file'),
+                            sourcedir=self.root, outdir=self.root,
+                            sources={}, verbosity=0)
+        self.docs_cache = MemoCache()
+        # Every thread renders with a `Pyccoon` instance of its own
+        self.local = threading.local()
+
+    def pyccoon(self):
+        pyccoon = getattr(self.local, 'pyccoon', None)
+        if pyccoon is None:
+            pyccoon = self.local.pyccoon = DetachedPyccoon(self.options, process=False)
+            pyccoon.docs_cache = self.docs_cache
+            if self.project_name:
+                pyccoon.project_name = self.project_name
+        return pyccoon
+
+    def language(self, code, path=None, language=None):
+        """ Language of the `code`: the forced one, or the one told by the path or the contents """
+        if language is not None:
+            return get_language(path or self.untitled, code, language=language)
+
+        found = get_language(path or self.untitled, code)
+        if found is None:
+            raise ValueError("Cannot tell the language of {0:s}, pass it as `language`"
+                             .format(path or "the code"))
+        return found
+
+    def render(self, code, path=None, language=None, page=False):
+        source = os.path.normpath(path or self.untitled).lstrip(os.sep)
+        language = self.language(code, path, language)
+        pyccoon = self.pyccoon()
+        if self.options.get('build_time') is None:
+            pyccoon.build_time = pyccoon.timestamp()
+        pyccoon.add(source, code, language)
+        try:
+            sections = pyccoon.document(source, code, language)
+            return pyccoon.generate_html(source, sections) if page else sections
+        finally:
+            pyccoon.remove(source)
+
+    def sections(self, code, path=None, language=None):
+        """
+        Split the `code` into sections with their `docs_html` and `code_html`.
+
+        :param path: Path of the source within its project. It tells the language, and the\
+            `[[...]]` cross-references are resolved relative to it.
+        :param language: Name of the language (e.g. `"Python"`) if the path cannot tell it
+        """
+        return self.render(code, path, language)
+
+    def page(self, code, path=None, language=None):
+        """ The whole HTML page of the `code`, as a build would write it """
+        return self.render(code, path, language, page=True)
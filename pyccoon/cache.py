@@ -0,0 +1,191 @@
+"""
+## Disk cache
+
+A content-addressed cache in a folder: every value is stored in a file named by the hash of its\
+key. Reading a value touches the file, so that when the folder grows over its size limit, the\
+least recently used entries are the ones removed.
+
+Several processes may share a cache folder. Entries are written to a temporary file first and\
+then moved in place, so a reader never sees a partial value; a failed read or write is simply\
+a cache miss.
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import open
+
+from .manifest import digest
+from .output import replace
+
+
+class DiskCache(object):
+
+    # When the limit is exceeded, the least recently used entries are removed until the cache
+    # takes up this fraction of the limit, so that eviction does not happen on every write.
+    low_watermark = 0.9
+
+    def __init__(self, folder, max_size=100 * 1024 * 1024):
+        """
+        :param folder: Cache folder, created on first write
+        :param max_size: Size limit of all the entries, in bytes
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.size = None
+        self.hits = self.misses = 0
+
+    def path(self, key):
+        name = digest(*key)
+        return os.path.join(self.folder, name[:2], name[2:])
+
+    def get(self, key, default=None):
+        """ Value stored under the `key`, a tuple of strings """
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                value = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self.path(key)
+        data = value.encode('utf8')
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            replace(temp, path)
+        except (IOError, OSError):
+            return
+
+        if self.size is None:
+            self.size = self.measure()
+        else:
+            self.size += len(data)
+        if self.size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        """ `(last use, size, path)` of every entry """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def measure(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is below the low watermark """
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_size * self.low_watermark:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def namespace(self, name):
+        return CacheNamespace(self, name)
+
+
+class CacheNamespace(object):
+    """
+    The entries of a `DiskCache` under keys of their own, e.g. the highlighted code and the docs.\
+    All the namespaces of a cache share its folder and its size limit.
+    """
+
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.cache.get((self.name,) + tuple(key))
+        if value is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.cache.set((self.name,) + tuple(key), value)
+
+
+class MemoCache(object):
+    """
+    ### Memo cache
+    In-memory cache of the most recently used values, optionally backed by a `DiskCache` that\
+    keeps them between the builds. It can be shared between threads.
+
+    Besides the number of entries, the total `len()` of the values can be limited by `max_size`.
+    """
+
+    missing = object()
+
+    def __init__(self, max_entries=10000, disk=None, max_size=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.disk = disk
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def sizeof(self, value):
+        return len(value) if self.max_size is not None else 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            # Move the entry to the end, as the most recently used
+            value = self.entries.pop(key, self.missing)
+            if value is not self.missing:
+                self.entries[key] = value
+                self.hits += 1
+                return value
+
+        value = self.disk.get(key) if self.disk is not None else None
+        if value is None:
+            with self.lock:
+                self.misses += 1
+            return default
+
+        with self.lock:
+            self.hits += 1
+        self.remember(key, value)
+        return value
+
+    def set(self, key, value):
+        self.remember(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def remember(self, key, value):
+        with self.lock:
+            previous = self.entries.pop(key, self.missing)
+            if previous is not self.missing:
+                self.size -= self.sizeof(previous)
+            self.entries[key] = value
+            self.size += self.sizeof(value)
+            while self.entries and (len(self.entries) > self.max_entries or
+                                    self.max_size is not None and self.size > self.max_size):
+                self.size -= self.sizeof(self.entries.popitem(last=False)[1])
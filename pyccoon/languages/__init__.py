@@ -2,30 +2,54 @@
 
 import re
 import os
+import threading
 
-import pygments
-from pygments import lexers, formatters
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
-from markdown import markdown
-from .. import markdown_extensions
+from .. import __version__
 
 from ..utils import cached_property
-from .utils import Section, ParsingStrategy, iterate_sections,\
+from .utils import Section, ParsingStrategy, Grammar, iterate_sections,\
     split_section_by_regex, split_code_by_pos
 
 
-default_markdown_extensions = [
-    markdown_extensions.LinesConnector(),
-    markdown_extensions.SaneDefList(),
-    markdown_extensions.Todo(),
-    markdown_extensions.Pydoc(),
-    markdown_extensions.AutoLinkExtension(),
-    markdown_extensions.MathExtension(),
-    "markdown.extensions.def_list",
-    "markdown.extensions.fenced_code",
-    'markdown.extensions.codehilite',
-    'markdown.extensions.tables'
-  ]
+# Pygments and Markdown take a while to import, so they are only imported when the first file
+# is highlighted or the first docs are converted.
+
+def default_markdown_extensions():
+    """ New instances of the Markdown extensions every language uses """
+    from .. import markdown_extensions
+
+    return [
+        markdown_extensions.LinesConnector(),
+        markdown_extensions.SaneDefList(),
+        markdown_extensions.Todo(),
+        markdown_extensions.Pydoc(),
+        markdown_extensions.AutoLinkExtension(),
+        markdown_extensions.MathExtension(),
+        "markdown.extensions.def_list",
+        "markdown.extensions.fenced_code",
+        'markdown.extensions.codehilite',
+        'markdown.extensions.tables'
+    ]
+
+
+def markdown_version():
+    """ Version of the installed Markdown """
+    import markdown
+
+    # Markdown 2.x has a `__version__` submodule and keeps the actual version elsewhere
+    version = getattr(markdown, '__version__', None)
+    if not isinstance(version, str):
+        version = markdown.version
+    return version
+
+
+indentation_re = re.compile(r"^([ \t]*)")
+leading_whitespace_re = re.compile(r"^(\s*)")
 
 
 class Language(object):
@@ -38,12 +62,25 @@ class Language(object):
     """
 
     extensions = []
+    # Exact names of the files in the language, and the names of its interpreters in the `#!`\
+    # lines besides the name of the language itself
+    # (see [[./__init__.py#detecting-the-language]])
+    filenames = []
+    interpreters = []
     scope_keywords = []
     filename_substitutes = {}
-    markdown_extensions = default_markdown_extensions
     postprocessors = []
     preprocessors = []
 
+    # Cost of documenting the language relative to the others, for balancing the work
+    cost_weight = 1.0
+
+    # Markdown engines are replaced after this many conversions, so that whatever they
+    # accumulate internally does not grow for the whole build.
+    markdown_engine_uses = 1000
+
+    # Characters of code highlighted at a time when a page is streamed
+    highlight_chunk_size = 64 * 1024
 
     @property
     def name(self):
@@ -52,17 +89,102 @@ class Language(object):
     @cached_property
     def lexer(self):
         """ Pygments lexer corresponding to the language """
+        from pygments import lexers
         return lexers.get_lexer_by_name(self.name.lower())
 
     def highlight(self, code, formatter="html"):
         """ Use pygments to highlight the `code` """
+        import pygments
+        from pygments import formatters
         return pygments.highlight(
             code, self.lexer,
             formatters.get_formatter_by_name(formatter)
         )
 
+    def highlight_pieces(self, code):
+        """
+        `highlight` the `code` piece by piece: together the pieces are the same HTML, but it is\
+        never held whole. The code is lexed once, and every piece is made of whole lines of\
+        about `highlight_chunk_size` characters, since the formatter handles every line by\
+        itself.
+        """
+        import pygments
+        from pygments import formatters
+        from pygments.token import Token
+
+        # The wrapping the formatter puts around the whole code
+        marker = u"PYCCOON\n"
+        prefix, suffix = pygments.format([(Token.Text, marker)],
+                                         formatters.get_formatter_by_name("html")).split(marker)
+        formatter = formatters.get_formatter_by_name("html", nowrap=True)
+
+        yield prefix
+        tokens = []
+        size = 0
+        for token in self.lexer.get_tokens(code):
+            tokens.append(token)
+            size += len(token[1])
+            if size >= self.highlight_chunk_size and token[1].endswith("\n"):
+                yield pygments.format(tokens, formatter)
+                tokens, size = [], 0
+        if tokens:
+            yield pygments.format(tokens, formatter)
+        yield suffix
+
+    @cached_property
+    def markdown_extensions(self):
+        """ Extensions of the Markdown engine """
+        return default_markdown_extensions()
+
+    @cached_property
+    def markdown_engines(self):
+        """ Per-thread storage of the `Markdown` engines """
+        return threading.local()
+
+    def markdown_engine(self):
+        """
+        Return the `Markdown` engine of the current thread. Setting up all the\
+        `markdown_extensions` is much more expensive than the conversion itself, so a single\
+        engine is `reset()` and reused between the conversions.
+        """
+        import markdown
+
+        local = self.markdown_engines
+        if getattr(local, 'uses', self.markdown_engine_uses) >= self.markdown_engine_uses:
+            local.engine = markdown.Markdown(extensions=self.markdown_extensions)
+            local.uses = 0
+
+        local.uses += 1
+        return local.engine.reset()
+
     def markdown(self, docs):
-        return markdown(docs, extensions=self.markdown_extensions)
+        return self.markdown_engine().convert(docs)
+
+    def prepare_docs(self, docs):
+        """ Let the `markdown_extensions` see all the docs of a file before they are converted """
+        for extension in self.markdown_extensions:
+            if hasattr(extension, 'prepare'):
+                extension.prepare(docs)
+
+    @cached_property
+    def markdown_signature(self):
+        """
+        Everything the `markdown` output depends on besides the docs: the versions of Pyccoon\
+        and Markdown and the extensions with their settings, and whatever else they report with\
+        `signature()`. Languages with the same signature convert the same docs into the same\
+        HTML.
+        """
+        extensions = []
+        for extension in self.markdown_extensions:
+            if isinstance(extension, str):
+                extensions.append(extension)
+            else:
+                configs = sorted(extension.getConfigs().items()) \
+                    if hasattr(extension, 'getConfigs') else []
+                extensions.append("{0}.{1}{2!r}{3}".format(
+                    type(extension).__module__, type(extension).__name__, configs,
+                    extension.signature() if hasattr(extension, 'signature') else ''))
+        return "|".join([__version__, markdown_version()] + extensions)
 
     def transform_filename(self, filename):
         """
@@ -71,16 +193,13 @@ class Language(object):
         `__init__.py` corresponds to the index file of the folder and should be turned into\
         `index.html`
 
-        If no `filename_substitutes` declared, the filename extension will be replaced by `.html`.
+        Otherwise `.html` is appended to the filename, also to the names of the files that\
+        have none of the `extensions` and were recognized by their contents.
         """
         if filename in self.filename_substitutes:
             return self.filename_substitutes[filename]
 
-        for extension in self.extensions:
-            if filename.endswith(extension):
-                return filename + ".html"
-
-        return filename
+        return filename + ".html"
 
     def strategy(self):
         """ Language parsing strategy - i.e., a list of methods to be applied to the code \
@@ -90,12 +209,24 @@ class Language(object):
                                self.set_sections_levels, self.merge_down,
                                self.set_sections_levels, self.absorb)
 
+    def patterns(self):
+        """ Regular expressions used by the `strategy` steps, by name """
+        return {}
+
+    @cached_property
+    def grammar(self):
+        """
+        The `strategy` and the `patterns` of the language compiled into a `Grammar`. This happens\
+        once, when the language is registered, and every parse reuses it.
+        """
+        return Grammar([method.__name__ for method in self.strategy()], **self.patterns())
+
     def parse(self, code, add_lineno=True):
-        """ Apply `self.strategy()` to the `code` """
+        """ Apply the `self.strategy()` steps to the `code` """
         sections = [Section(code_text=code)]
 
-        for method in self.strategy():
-            sections = method(sections)
+        for name in self.grammar.steps:
+            sections = getattr(self, name)(sections)
 
         # Strip empty sections
         sections = [section for section in sections if section.has_code() or section.has_docs()]
@@ -113,16 +244,16 @@ class Language(object):
     @iterate_sections(start=0)
     def set_sections_levels(self, sections, i):
         if sections[i]["code_text"]:
-            indent = re.match(r"^([ \t]*)", sections[i]["code_text"]).group(1)
+            indent = indentation_re.match(sections[i]["code_text"]).group(1)
             sections[i]["level"] = len(indent)
         elif i > 0:
             sections[i]["level"] = sections[i-1]['level']
 
     @iterate_sections(start=0)
     def strip_docs_indentation(self, sections, i):
-        indent = re.match(r"^([ \t]*)", sections[i]["docs_text"], re.M).group(1)
+        indent = indentation_re.match(sections[i]["docs_text"]).group(1)
 
-        sections[i]["docs_text"] = re.compile(r"^{0}".format(indent), re.M)\
+        sections[i]["docs_text"] = Grammar.indented(r"^{0}", indent)\
             .sub("", sections[i]["docs_text"])
 
     @iterate_sections()
@@ -167,6 +298,8 @@ class Language(object):
 
 class PlainText(Language):
     extensions = ['.txt']
+    # Nothing to highlight
+    cost_weight = 0.5
     filename_substitutes = {
         'index.txt': 'index.html',
         'README': 'index.html'
@@ -177,6 +310,9 @@ class PlainText(Language):
     def highlight(self, code):
         return code
 
+    def highlight_pieces(self, code):
+        yield code
+
     def parse(self, code, add_lineno=True):
         return [Section(docs_text=code)]
 
@@ -217,11 +353,19 @@ class InlineCommentLanguage(Language):
         base_strategy.insert(0, self.parse_inline)
         return base_strategy
 
-    @cached_property
-    def inline_prefix(self):
-        return re.compile(r"^[ \t]*{0}".format(self.inline_delimiter), re.M)
+    def patterns(self):
+        patterns = super(InlineCommentLanguage, self).patterns()
+        patterns.update(
+            inline_prefix=re.compile(r"^[ \t]*{0}".format(self.inline_delimiter), re.M),
+            inline_re=self.inline_re,
+            # The mirror of `divider_text` that we expect Pygments to return. We can split \
+            # on this to recover the original sections.
+            divider_html=re.compile(r'\n*<span class="c[1]?">{0}DIVIDER</span>\n*'
+                                    .format(self.inline_delimiter))
+        )
+        return patterns
 
-    @cached_property
+    @property
     def inline_re(self):
         """
             ^\s*{0}\s*(.+$)
@@ -257,18 +401,15 @@ class InlineCommentLanguage(Language):
 
     @property
     def divider_html(self):
-        # The mirror of `divider_text` that we expect Pygments to return. We can split \
-        # on this to recover the original sections.
-        return re.compile(r'\n*<span class="c[1]?">{0}DIVIDER</span>\n*'
-                          .format(self.inline_delimiter))
+        return self.grammar.divider_html
 
     @iterate_sections(start=0)
     def parse_inline(self, sections, i):
-        new_sections = split_section_by_regex(sections[i], self.inline_re)
+        new_sections = split_section_by_regex(sections[i], self.grammar.inline_re)
         for j, section in enumerate(new_sections):
             if section.get("meta") != "stripped":
-                new_sections[j]["docs_text"] = self.inline_prefix.sub("",
-                                                                      new_sections[j]["docs_text"])
+                new_sections[j]["docs_text"] = self.grammar.inline_prefix.sub(
+                    "", new_sections[j]["docs_text"])
                 new_sections[j]["meta"] = "stripped"
 
         sections[i:i+1] = new_sections
@@ -317,13 +458,17 @@ class MultilineCommentLanguage(Language):
         base_strategy.insert(0, self.parse_multiline)
         return base_strategy
 
+    def patterns(self):
+        patterns = super(MultilineCommentLanguage, self).patterns()
+        patterns.update(multiline_re=self.multiline_re,
+                        multistart_re=re.compile(r"^\n*(\s*){0}".format(self.multistart)))
+        return patterns
+
     @iterate_sections(start=0)
     def parse_multiline(self, sections, i):
-        sections[i:i+1] = split_section_by_regex(sections[i], self.multiline_re,
+        sections[i:i+1] = split_section_by_regex(sections[i], self.grammar.multiline_re,
                                                  meta="stripped")
-        sections[i]["docs_text"] = re.sub(r"^\n*(\s*){0}".format(self.multistart),
-                                          r"\1",
-                                          sections[i]["docs_text"])
+        sections[i]["docs_text"] = self.grammar.multistart_re.sub(r"\1", sections[i]["docs_text"])
 
 
 class DoubleQuoteDocstringLanguage(Language):
@@ -340,16 +485,19 @@ class DoubleQuoteDocstringLanguage(Language):
         base_strategy.insert(0, self.parse_multiline)
         return base_strategy
 
+    def patterns(self):
+        patterns = super(DoubleQuoteDocstringLanguage, self).patterns()
+        patterns.update(multiline_re=self.multiline_re,
+                        multistart_re=re.compile(r'^\n*(\s*)"'))
+        return patterns
 
     @iterate_sections(start=0)
     def parse_multiline(self, sections, i):
-        sections[i:i+1] = split_section_by_regex(sections[i], self.multiline_re,
+        sections[i:i+1] = split_section_by_regex(sections[i], self.grammar.multiline_re,
                                                  meta="stripped")
-        sections[i]["docs_text"] = re.sub(r'^\n*(\s*)"',
-                                          r'\1',
-                                          sections[i]["docs_text"])
+        sections[i]["docs_text"] = self.grammar.multistart_re.sub(r'\1', sections[i]["docs_text"])
 
-        sections[i]["docs_text"] = re.sub(r'\\', '', sections[i]["docs_text"])
+        sections[i]["docs_text"] = sections[i]["docs_text"].replace('\\', '')
 
 
 
@@ -367,11 +515,17 @@ class IndentBasedLanguage(Language):
         https://github.com/Cirru/cirru-parser
     """
 
+    def patterns(self):
+        patterns = super(IndentBasedLanguage, self).patterns()
+        patterns.update(scope_re=re.compile(r"({0})".format("|".join(self.scope_keywords)),
+                                            flags=re.M))
+        return patterns
+
     @iterate_sections(start=0)
     def split_by_scopes(self, sections, i):
-        indent = re.match(r"^(\s*)", sections[i]["code_text"].strip("\n")).group(1)
+        indent = leading_whitespace_re.match(sections[i]["code_text"].strip("\n")).group(1)
 
-        regex = re.compile(r"^(\s{{0,{0}}}\S)".format(len(indent) - 1), flags=re.M)
+        regex = Grammar.indented(r"^(\s{{0,{0}}}\S)", len(indent) - 1)
         match = regex.search(sections[i]["code_text"], pos=len(indent) + 1)
 
         if match:
@@ -379,7 +533,7 @@ class IndentBasedLanguage(Language):
             sections[i]['level'] = len(indent)
             sections[i+1]['level'] = len(match.group(1).strip("\n"))
 
-        regex = re.compile(r"({0})".format("|".join(self.scope_keywords)), flags=re.M)
+        regex = self.grammar.scope_re
         match = regex.search(sections[i]["code_text"])
 
         if match and match.start() == 0:
@@ -432,12 +586,18 @@ class KeywordLinksMixin(Language):
 
 class BraceBasedLanguage(Language):
 
+    def patterns(self):
+        patterns = super(BraceBasedLanguage, self).patterns()
+        patterns.update(scope_re=re.compile(r"^({0})".format("|".join(self.scope_keywords)),
+                                            flags=re.M))
+        return patterns
+
     @iterate_sections(start=0)
     def split_by_scopes(self, sections, i):
         """ Split the code sections by `scope_keywords` of the language
             TODO: consider splitting also by braces interiors"""
 
-        regex = re.compile(r"^({0})".format("|".join(self.scope_keywords)), flags=re.M)
+        regex = self.grammar.scope_re
         match = regex.search(sections[i]["code_text"])
 
         if match and match.start() == 0:
@@ -497,10 +657,15 @@ class C(BraceBasedLanguage, InlineCommentLanguage, MultilineCommentLanguage):
     #                 markdown_extensions.LineConnector(regex=r"([\w\.])[ \t]*\n[ \t]*(\w)")
     # ```
 
+    def patterns(self):
+        patterns = super(C, self).patterns()
+        patterns.update(commenting_design_re=re.compile(r"^[ \t]*(\/+|\*+)(.*)$", re.M))
+        return patterns
+
     @iterate_sections(start=0)
     def strip_commenting_design(self, sections, i):
-        sections[i]["docs_text"] = re.compile(r"^[ \t]*(\/+|\*+)(.*)$", re.M)\
-            .sub(r"\2", sections[i]["docs_text"])
+        sections[i]["docs_text"] = self.grammar.commenting_design_re.sub(r"\2",
+                                                                         sections[i]["docs_text"])
 
     def strategy(self):
         base_strategy = super(C, self).strategy()
@@ -525,6 +690,7 @@ class JavaScript(C):
     """
 
     extensions = [".js"]
+    interpreters = ["node", "nodejs"]
 
     scope_keywords = [r"\s*(class)", r"^.*(function)[ \t]*\("]
 
@@ -546,6 +712,8 @@ class Python(IndentBasedLanguage, MultilineCommentLanguage, InlineCommentLanguag
     TODO: support also `'''` comment delimiters.
     """
     extensions = [".py", ".pyx"]
+    filenames = ["SConstruct", "SConscript", "wscript"]
+    interpreters = ["pypy"]
     inline_delimiter = "#"
     ignored_inline_patterns = [
         # Shebang patterns, e.g. `#!/usr/bin/python`
@@ -613,6 +781,7 @@ class Ruby(IndentBasedLanguage, InlineCommentLanguage, MultilineCommentLanguage)
     will have to rethink multiline comments capturing to support them all
     """
     extensions = [".rb"]
+    filenames = ["Rakefile", "Gemfile", "Guardfile", "Vagrantfile"]
     inline_delimiter = "#"
     multistart = "=begin"
     multiend = "=end"
@@ -625,6 +794,7 @@ class CoffeeScript(IndentBasedLanguage, InlineCommentLanguage, MultilineCommentL
     ### CoffeeScript
     """
     extensions = [".coffee"]
+    filenames = ["Cakefile"]
     name = "Coffee-Script"
     # the inline comments will work only if you add space after them
     inline_delimiter = "# "
@@ -645,6 +815,9 @@ class Haskell(InlineCommentLanguage, MultilineCommentLanguage):
     TODO: Does anyone still use literate haskell? It'd be intersing to support it.
     """
     extensions = [".hs"]
+    # Haddock comments are converted by pandoc
+    cost_weight = 3.0
+    interpreters = ["runhaskell", "runghc"]
     inline_delimiter = "--"
     multistart = "{-"
     multiend = "-}"
@@ -665,8 +838,10 @@ class Haskell(InlineCommentLanguage, MultilineCommentLanguage):
     # The markup format, however, is easy, and that's what we
     # intend to support.
     # See the extension definition for details.
-    markdown_extensions = \
-        default_markdown_extensions + [markdown_extensions.Haddock()]
+    @cached_property
+    def markdown_extensions(self):
+        from .. import markdown_extensions
+        return default_markdown_extensions() + [markdown_extensions.Haddock()]
 
 
 """
@@ -706,11 +881,14 @@ class Clojure(IndentBasedLanguage,
     extensions = [".cljs", ".clj"]
     inline_delimiter = ";;"
 
-    nsLinksExt = markdown_extensions.NsLinks()
-    nsLinksExt.namespace_re = "\S+/"
     anchor_prefix = '_'
 
-    markdown_extensions = default_markdown_extensions + [nsLinksExt]
+    @cached_property
+    def markdown_extensions(self):
+        from .. import markdown_extensions
+        nsLinksExt = markdown_extensions.NsLinks()
+        nsLinksExt.namespace_re = "\S+/"
+        return default_markdown_extensions() + [nsLinksExt]
 
     scope_keywords = [r"^\s*\((def\S*)((\s+\^:\S*)*)\s+([^\s\)]*)",
                       r"^\s*\((ns)\s+([^\s\)]*)"]
@@ -739,17 +917,165 @@ class Tcl(InlineCommentLanguage):
 
 # ## Gathering all languages
 
-extensions_mapping = {}
+
+class LanguageRegistry(Mapping):
+    """
+    Languages by file extension. A language is only instantiated, and its grammar compiled, when\
+    it is first looked up, so that starting up does not pay for all of them.
+    """
+
+    def __init__(self, languages):
+        self.classes = {}
+        self.filenames = {}
+        self.aliases = {}
+        for language in languages:
+            for extension in language.extensions:
+                self.classes[extension] = language
+            for filename in language.filenames:
+                self.filenames[filename] = language
+
+            # The language can also be called by its name, extensions and interpreters
+            name = language.name if isinstance(language.name, str) else language.__name__
+            for alias in [name] + [extension.lstrip('.') for extension in language.extensions] \
+                    + language.interpreters:
+                self.aliases.setdefault(alias.lower(), language)
+        self.instances = {}
+
+    def instance(self, language):
+        instance = self.instances.get(language)
+        if instance is None:
+            instance = language()
+            # Compile the grammar right away
+            instance.grammar
+            instance = self.instances.setdefault(language, instance)
+        return instance
+
+    def __getitem__(self, extension):
+        return self.instance(self.classes[extension])
+
+    def __iter__(self):
+        return iter(self.classes)
+
+    def __len__(self):
+        return len(self.classes)
+
+    def by_filename(self, filename):
+        language = self.filenames.get(filename)
+        return self.instance(language) if language else None
+
+    def by_alias(self, alias):
+        language = self.aliases.get(alias.lower())
+        return self.instance(language) if language else None
+
+
 languages = [Markdown, Python, Fortran, PHP, C, JavaScript, Ruby, CoffeeScript, Haskell]
+extensions_mapping = LanguageRegistry(languages)
+
+
+# ## Detecting the language
+# The name of a file is enough most of the time. Otherwise the first line may be a `#!` line
+# naming the interpreter, or the first or the last lines an editor modeline like
+# `# vim: set ft=python:` or `-*- mode: ruby -*-`. Only if there are none, Pygments guesses the
+# language from the beginning of the file: guessing asks every single lexer, so it is slow, and
+# the slower the more text it is given.
+#
+# The contents are only looked at for files without an extension, or with one Pygments does not
+# know either. A `.go` or `.ts` file is in a language Pyccoon does not document, whatever it
+# looks like, and is copied as it is.
+
+extension_re = re.compile(r'.*(\..+)')
+shebang_re = re.compile(r'^#!\s*(\S+)(.*)')
+interpreter_re = re.compile(r'^([A-Za-z_+-]+?)[\d.]*$')
+vim_modeline_re = re.compile(r'\b(?:vi|vim|ex)\d*:.*?\b(?:ft|filetype|syntax)=([\w+-]+)')
+emacs_modeline_re = re.compile(r'-\*-(.+?)-\*-')
+emacs_mode_re = re.compile(r'(?:^|;)\s*mode:\s*([\w+-]+)', re.I)
+
+# Number of lines searched for modelines at both ends of a file
+modeline_lines = 5
+# Number of characters given to the Pygments guess
+guess_prefix_size = 4096
+
+
+def language_from_shebang(code):
+    """ Language of the interpreter in the `#!` line, e.g. `#!/usr/bin/env python3` """
+    match = shebang_re.match(code)
+    if not match:
+        return None
 
-for language in languages:
-    instance = language()
-    for extension in instance.extensions:
-        extensions_mapping[extension] = instance
+    interpreter = os.path.basename(match.group(1))
+    if interpreter == 'env':
+        arguments = [argument for argument in match.group(2).split()
+                     if not argument.startswith('-') and '=' not in argument]
+        if not arguments:
+            return None
+        interpreter = os.path.basename(arguments[0])
+
+    match = interpreter_re.match(interpreter)
+    return extensions_mapping.by_alias(match.group(1)) if match else None
+
+
+def language_from_modeline(code):
+    """ Language set by a Vim or Emacs modeline in the first or the last lines """
+    lines = code[:guess_prefix_size].split('\n', modeline_lines)[:modeline_lines]
+    if len(code) > guess_prefix_size:
+        lines += code[-guess_prefix_size:].rsplit('\n', modeline_lines)[-modeline_lines:]
+    else:
+        lines += code.split('\n')[-modeline_lines:]
+
+    for line in lines:
+        name = None
+        match = vim_modeline_re.search(line)
+        if match:
+            name = match.group(1)
+        else:
+            match = emacs_modeline_re.search(line)
+            if match:
+                variables = match.group(1)
+                if ':' not in variables:
+                    name = variables.strip()
+                else:
+                    mode = emacs_mode_re.search(variables)
+                    name = mode and mode.group(1)
+        if name:
+            language = extensions_mapping.by_alias(name)
+            if language:
+                return language
+    return None
+
+
+def guess_language(code):
+    """ Language of the Pygments lexer that fits the beginning of the `code` best """
+    from pygments import lexers
+
+    try:
+        lexer = lexers.guess_lexer(code[:guess_prefix_size])
+    except Exception:
+        return None
+
+    for alias in [lexer.name] + list(lexer.aliases):
+        language = extensions_mapping.by_alias(alias)
+        if language:
+            return language
+    return None
+
+
+def known_extension(filename):
+    """ Whether Pygments has a lexer for the extension of the `filename` """
+    from pygments import lexers
+    from pygments.util import ClassNotFound
+
+    try:
+        lexers.get_lexer_for_filename(filename)
+    except ClassNotFound:
+        return False
+    return True
 
 
 def get_language(source, code, language=None):
-    """Get the current language we're documenting, based on the extension."""
+    """
+    Get the current language we're documenting: by the extension or the name of the file, or,\
+    if the `code` is given and the extension is unknown, by its contents.
+    """
 
     if language is not None:
         for l in extensions_mapping.values():
@@ -758,17 +1084,13 @@ def get_language(source, code, language=None):
         else:
             raise ValueError("Unknown forced language: " + language)
 
-    m = re.match(r'.*(\..+)', os.path.basename(source))
-
+    filename = os.path.basename(source)
+    m = extension_re.match(filename)
     if m and m.group(1) in extensions_mapping:
         return extensions_mapping[m.group(1)]
-    else:
-        try:
-            lang = lexers.guess_lexer(code).name.lower()
-        except Exception:
-            return None
-        for l in extensions_mapping.values():
-            if l.name == lang:
-                return l
-        else:
-            return None
+
+    language = extensions_mapping.by_filename(filename)
+    if language or code is None or (m and known_extension(filename)):
+        return language
+
+    return language_from_shebang(code) or language_from_modeline(code) or guess_language(code)
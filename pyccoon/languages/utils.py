@@ -1,3 +1,6 @@
+import re
+
+
 class Section(dict):
 
     """ Helper class that includes some frequently used routines """
@@ -58,21 +61,78 @@ class ParsingStrategy(list):
         self.pop(self.index(key))
 
 
+# ## Compiled grammar
+
+
+class Grammar(object):
+
+    """
+    Everything a language needs to parse a source, compiled once: the names of the `strategy`\
+    steps and the regular expressions. Grammars are immutable, so a single one can be shared by\
+    all the threads, and picklable, so it can be sent to the worker processes.
+    """
+
+    def __init__(self, steps, **patterns):
+        self.__dict__.update(patterns, steps=tuple(steps))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Grammar is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Grammar is immutable")
+
+    def __repr__(self):
+        return "Grammar({0})".format(", ".join(self.steps))
+
+    # Patterns that depend on the indentation of a section are compiled on first use and\
+    # shared by all the grammars.
+    _indented = {}
+
+    @classmethod
+    def indented(cls, pattern, indent):
+        """ Return the compiled `pattern.format(indent)` """
+        key = (pattern, indent)
+        if key not in cls._indented:
+            cls._indented[key] = re.compile(pattern.format(indent), flags=re.M)
+        return cls._indented[key]
+
+
 def iterate_sections(start=1, increment=1):
     """
     Helper decorator to iterate through the `sections` while altering them.
 
+    The decorated method only gets a window of the sections around the current one: the previous,\
+    the current and the next section. It may read, change and replace them (e.g.,\
+    `sections[i:i+1] = []`), and the window is put back in place afterwards. The rest of the\
+    sections sit in two stacks on both sides of the window, so that each step takes constant\
+    time instead of moving the whole tail of a long list.
+
     :param start: Section index to start with.  
     :param increment: Index increment. Use `-1` to iterate backwards.
     """
     def wrap(f):
         def wrapped_f(self, sections):
+            # The sections before the window, and the ones after it in reverse order
+            done, todo = [], sections[::-1]
             i = start
-            while i < len(sections) and i > -1:
-                new_i = f(self, sections, i)
-                i = new_i if new_i else i + increment
-
-            return sections
+            while -1 < i < len(done) + len(todo):
+                low = i - 1 if i > 0 else 0
+                while len(done) > low:
+                    todo.append(done.pop())
+                while len(done) < low:
+                    done.append(todo.pop())
+
+                window = todo[low - i - 2:]
+                del todo[low - i - 2:]
+                window.reverse()
+                new_i = f(self, window, i - low)
+                window.reverse()
+                todo += window
+
+                i = low + new_i if new_i is not None and low + new_i else i + increment
+
+            todo.reverse()
+            return done + todo
 
         wrapped_f.__name__ = f.__name__
         return wrapped_f
@@ -0,0 +1,132 @@
+"""
+## Build manifest
+
+A record of the previous build stored in the output folder. For every source it keeps the hash
+of the file contents, the detected language and the destination, plus a single `fingerprint` of
+everything else the pages depend on (configuration, templates, package versions).
+
+A source can be skipped when both its own hash and the build fingerprint are unchanged.
+"""
+
+import hashlib
+import json
+import os
+from io import open
+
+from .output import write_file
+
+
+def digest(*parts):
+    """ Content hash used throughout the manifest """
+    sha = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = (part or '').encode('utf8')
+        sha.update(part)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class BuildManifest(object):
+
+    filename = '.pyccoon-manifest.json'
+
+    def __init__(self, outdir, fingerprint):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, self.filename)
+        self.fingerprint = fingerprint
+        self.previous = {}
+        self.fresh = False
+        self.sources = {}
+        self.load()
+
+    def load(self):
+        """ Read the manifest of the previous build, if there is one """
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        self.previous = data.get('sources', {})
+        self.fresh = data.get('fingerprint') == self.fingerprint
+        # Sources that are not rebuilt keep their previous records
+        self.sources = dict(self.previous)
+
+    def entry(self, destination, data, language=None):
+        return {
+            'hash': digest(data),
+            'language': language,
+            'destination': os.path.relpath(destination, self.outdir),
+        }
+
+    def is_current(self, source, entry):
+        """ Whether the `source` output from the previous build can be reused as is """
+        return self.fresh and self.previous.get(source) == entry and \
+            os.path.exists(os.path.join(self.outdir, entry['destination']))
+
+    def record(self, source, entry):
+        self.sources[source] = entry
+
+    def discard(self, source):
+        self.sources.pop(source, None)
+
+    def stale(self, sources):
+        """
+        Forget the sources that are not among `sources` anymore and return the absolute paths of
+        their outputs, unless some other source is rendered into the same place now.
+        """
+        destinations = set(sf.destination for sf in sources.values())
+        stale = []
+        for source in list(self.sources):
+            if source not in sources:
+                destination = os.path.join(self.outdir, self.sources.pop(source)['destination'])
+                if destination not in destinations:
+                    stale.append(destination)
+        return stale
+
+    def save(self):
+        write_file(self.path, json.dumps({
+            'fingerprint': self.fingerprint,
+            'sources': self.sources
+        }, sort_keys=True, indent=1, ensure_ascii=False).encode('utf8'))
+
+
+class DetectedLanguages(object):
+    """
+    ### Detected languages
+    Languages of the files that could only be told by their contents, by the source path and\
+    the hash of the contents, so that the next build does not have to detect them again.
+    """
+
+    filename = '.pyccoon-languages.json'
+
+    def __init__(self):
+        self.languages = {}
+
+    def get(self, source, content_hash, default=None):
+        """ Name of the language detected in the `source`, or `None` if it had none """
+        entry = self.languages.get(source)
+        if entry is None or entry[0] != content_hash:
+            return default
+        return entry[1]
+
+    def set(self, source, content_hash, language):
+        self.languages[source] = [content_hash, language]
+
+    def update(self, other):
+        self.languages.update(other.languages)
+
+    def load(self, path):
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                self.languages.update(json.load(f).get('sources', {}))
+        except (IOError, OSError, ValueError):
+            return
+
+    def save(self, path, sources):
+        """ :param sources: Collection of the existing sources, the rest are forgotten """
+        write_file(path, json.dumps({
+            'sources': dict((source, entry) for source, entry in self.languages.items()
+                            if source in sources)
+        }, sort_keys=True, indent=1, ensure_ascii=False).encode('utf8'))
@@ -6,6 +6,8 @@ from markdown.inlinepatterns import Pattern
 from markdown.preprocessors import Preprocessor
 from markdown.extensions import Extension
 
+from .cache import MemoCache
+
 
 class Todo(Extension):
 
@@ -264,64 +266,27 @@ class Haddock(Extension):
             text = match.group('down') or match.group('up')
 
             try:
-                import pypandoc
+                import pypandoc  # noqa
             except ImportError:
                 print("Install pandoc for Haddock extension")
                 return text
 
-            lines = text.split('\n')
-
-            """
-            The Module Characteristics
-
-            According to Haddock's docs, these fields aren't
-            really used by Haddock or any other program, for that matter,
-            but the are usually included in the file, and we want to
-            be able to typeset them correctly.
-
-            The supported fields are only: `Module`, `Description`,
-            `Copyright`, `License`, `Maintainer`, `Stability` and
-            `Portability`. The syntax is YAML-like.
-
-            Here is an example of the fields in use:
-
-              ```yaml
-              Module      : W
-              Description : Short description
-              Copyright   : (c) Some Guy, 2013; Someone Else, 2014
-              License     : GPL-3
-              Maintainer  : sample@email.com
-              Stability   : experimental
-              Portability : POSIX
-              ```
-
-            This is supposed to appear at the top of the module, but
-            I can't find a formal specification, so we will highlight any
-            valid characteristic (defined by the pair `name: value`,
-            where `name` is a characteristic name) anywhere in the file.
-            """
-
-            module_characteristics = []
-            for i, line in enumerate(lines):
-                match = re.match(characteristic_re, line)
-                if match:
-                    module_characteristics.append(match_to_html(match))
-                elif line.isspace() or not line:
-                    pass
-                else:
-                    break
-            characteristics_block = ''.join(module_characteristics)
-
-            # The rest of the text (after the last characteristic) is normal Haddock text.
-            rest = lines[i:]
+            characteristics_block, rest = split_characteristics(text)
             # Use *pypandoc* to convert Haddocks markup into HTML
-            converted_rest = pypandoc.convert('\n'.join(rest), 'html', format='haddock')
+            converted_rest = haddock_converter.convert(rest)
 
             if characteristics_block:
                 return haddock_template.format('\n'.join([characteristics_block, converted_rest]))
             else:
                 return haddock_template.format(converted_rest)
 
+        @classmethod
+        def texts(cls, docs):
+            """ Texts of all the Haddock comments in the `docs` that go to pandoc """
+            for text in docs:
+                for match in cls.regex.finditer(text):
+                    yield split_characteristics(match.group('down') or match.group('up'))[1]
+
         def run(self, lines):
             # We have no use for a list of lines, so we join them together.
             # It is easier to find the Haddock comments inside a text block
@@ -334,6 +299,22 @@ class Haddock(Extension):
     def extendMarkdown(self, md, md_globals):
         md.preprocessors.add('haddock', Haddock.Prep(md), '_begin')
 
+    def prepare(self, docs):
+        """ Convert the Haddock comments of all the `docs` of a file at once """
+        try:
+            import pypandoc  # noqa
+        except ImportError:
+            return
+        haddock_converter.convert_many(list(Haddock.Prep.texts(docs)))
+
+    def signature(self):
+        """ The HTML of the Haddock comments depends on the pandoc version, if any """
+        try:
+            import pypandoc
+            return "pandoc " + pypandoc.get_pandoc_version()
+        except (ImportError, OSError):
+            return "pandoc unavailable"
+
 
 # ### Haddock Utilities
 
@@ -355,6 +336,104 @@ characteristic_re = (r"^\s*(?P<key>{key_re})\s*:\s*(?P<value>.*)"
                      .format(key_re=characteristic_key_re))
 
 
+def split_characteristics(text):
+    """
+    Split a Haddock comment into the HTML of its module characteristics and the rest of the text.
+
+    According to Haddock's docs, these fields aren't
+    really used by Haddock or any other program, for that matter,
+    but the are usually included in the file, and we want to
+    be able to typeset them correctly.
+
+    The supported fields are only: `Module`, `Description`,
+    `Copyright`, `License`, `Maintainer`, `Stability` and
+    `Portability`. The syntax is YAML-like.
+
+    Here is an example of the fields in use:
+
+      ```yaml
+      Module      : W
+      Description : Short description
+      Copyright   : (c) Some Guy, 2013; Someone Else, 2014
+      License     : GPL-3
+      Maintainer  : sample@email.com
+      Stability   : experimental
+      Portability : POSIX
+      ```
+
+    This is supposed to appear at the top of the module, but
+    I can't find a formal specification, so we will highlight any
+    valid characteristic (defined by the pair `name: value`,
+    where `name` is a characteristic name) anywhere in the file.
+    """
+    lines = text.split('\n')
+
+    module_characteristics = []
+    for i, line in enumerate(lines):
+        match = re.match(characteristic_re, line)
+        if match:
+            module_characteristics.append(match_to_html(match))
+        elif line.isspace() or not line:
+            pass
+        else:
+            break
+
+    # The rest of the text (after the last characteristic) is normal Haddock text.
+    return ''.join(module_characteristics), '\n'.join(lines[i:])
+
+
+class HaddockConverter(object):
+    """
+    #### Haddock conversion
+
+    Every pandoc run starts a new process, which takes much longer than the conversion itself.\
+    The Haddock texts of a whole file are converted in a single run instead: they are joined\
+    with delimiter paragraphs, and the HTML is split back on them, every part ending with the\
+    newline a run of its own would end with. The results are kept, so that the preprocessor\
+    finds its texts already converted.
+    """
+
+    delimiter = "PYCCOONHADDOCKDELIMITER"
+    delimiter_re = re.compile(r'(?<=\n)<p>{0}</p>\n'.format(delimiter))
+
+    def __init__(self):
+        self.results = MemoCache()
+
+    def pandoc(self, text):
+        import pypandoc
+        return pypandoc.convert(text, 'html', format='haddock')
+
+    def convert(self, text):
+        html = self.results.get(text)
+        if html is None:
+            html = self.pandoc(text)
+            self.results.set(text, html)
+        return html
+
+    def convert_many(self, texts):
+        """ Convert the `texts` in a single pandoc run, if there are several of them """
+        missing = []
+        for text in texts:
+            if text not in self.results.entries and text not in missing:
+                missing.append(text)
+        if len(missing) < 2:
+            return
+
+        delimiter = "\n\n{0}\n\n".format(self.delimiter)
+        try:
+            parts = self.delimiter_re.split(self.pandoc(delimiter.join(missing)))
+        except Exception:
+            return
+
+        # If some text swallowed a delimiter, they are converted one by one later
+        if len(parts) == len(missing):
+            for text, html in zip(missing, parts):
+                self.results.set(text, html)
+
+
+haddock_converter = HaddockConverter()
+
+
 # #### Template for a Haddock comment
 
 haddock_template = """
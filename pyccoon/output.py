@@ -0,0 +1,137 @@
+"""
+## Output files
+
+Every file Pyccoon puts into the output folder goes through an `OutputFile`. The new contents are\
+compared with the file already there while they are being written, and the file is only\
+replaced if they differ: unchanged pages keep their modification times, so that `rsync` and the\
+like only transfer what actually changed.
+
+A changed file is written to a temporary file next to it and then moved in place, so a reader\
+(or a web server) never sees a half-written page.
+"""
+
+import os
+import tempfile
+
+
+def replace(source, destination):
+    """ `os.replace` where it exists, a rename that works on POSIX systems elsewhere """
+    getattr(os, 'replace', os.rename)(source, destination)
+
+
+def default_mode():
+    """ Permissions of a newly created file, as `open()` would create it """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class OutputFile(object):
+    """
+    A binary file that replaces the `path` when it is closed, unless the same contents are there\
+    already. Use it as a context manager: if the block fails, the `path` is left as it was.
+    """
+
+    chunk_size = 64 * 1024
+    mode = None
+
+    def __init__(self, path):
+        self.path = path
+        self.temp = self.temp_path = None
+        self.changed = None
+        # Number of bytes written so far that are the same as in the existing file
+        self.matched = 0
+        try:
+            self.existing = open(path, 'rb')
+        except (IOError, OSError):
+            self.existing = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, data):
+        if self.temp is None and self.existing is not None:
+            # A block at a time, however much data there is
+            for start in range(0, len(data), self.chunk_size):
+                block = data[start:start + self.chunk_size]
+                if self.existing.read(len(block)) != block:
+                    self.start()
+                    self.temp.write(memoryview(data)[start:])
+                    return
+                self.matched += len(block)
+            return
+        if self.temp is None:
+            self.start()
+        self.temp.write(data)
+
+    def start(self):
+        """ Start writing the temporary file with the part that matched the existing file """
+        folder, filename = os.path.split(self.path)
+        fd, self.temp_path = tempfile.mkstemp(dir=folder, prefix='.' + filename, suffix='.tmp')
+        self.temp = os.fdopen(fd, 'wb')
+
+        if self.existing is not None:
+            self.existing.seek(0)
+            remaining = self.matched
+            while remaining:
+                chunk = self.existing.read(min(remaining, self.chunk_size))
+                self.temp.write(chunk)
+                remaining -= len(chunk)
+            self.existing.close()
+            self.existing = None
+
+    def close(self):
+        """ Replace the file if anything changed. Returns whether it did. """
+        if self.changed is not None:
+            return self.changed
+
+        # The file is gone or it has more contents than the new ones
+        if self.temp is None and (self.existing is None or self.existing.read(1)):
+            self.start()
+
+        if self.existing is not None:
+            self.existing.close()
+
+        self.changed = self.temp is not None
+        if self.changed:
+            self.temp.close()
+            if OutputFile.mode is None:
+                OutputFile.mode = default_mode()
+            os.chmod(self.temp_path, OutputFile.mode)
+            replace(self.temp_path, self.path)
+        return self.changed
+
+    def discard(self):
+        if self.existing is not None:
+            self.existing.close()
+        if self.temp is not None:
+            self.temp.close()
+            try:
+                os.unlink(self.temp_path)
+            except OSError:
+                pass
+        self.changed = False
+
+
+def write_file(path, data):
+    """ Write the `data` bytes to the `path`, if they differ from what is there """
+    with OutputFile(path) as f:
+        f.write(data)
+    return f.changed
+
+
+def copy_file(source, destination):
+    """ `shutil.copyfile` that leaves the `destination` alone if it is the same already """
+    with open(source, 'rb') as src, OutputFile(destination) as f:
+        while True:
+            chunk = src.read(OutputFile.chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+    return f.changed
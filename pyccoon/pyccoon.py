@@ -8,23 +8,28 @@
 """
 
 
+import json
 import optparse
 import os
-import shutil
-import pystache
 import re
 import sys
-import yaml
 from io import open
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import defaultdict
 
 
 # This module contains all of our static resources.
 from . import resources, __version__, __author__
-from .languages import get_language, Language
+from .languages import get_language, Language, markdown_version
+from .cache import DiskCache, MemoCache
+from .manifest import BuildManifest, DetectedLanguages, digest
+from .output import OutputFile, copy_file, write_file
+from .templates import SectionStream, compile_template
+from .timing import BuildProfile, Timer
+from .xref import CrossReferences
 
-from .utils import shift, ensure_directory, SourceFile
+from .utils import cached_property, isplit_pieces, ensure_directory, walk_sources, commit_time, \
+    split_shards, SourceFile, SourceRecord, SourceTree, DependencyGraph, PathMatcher
 
 
 # ## Main documentation generation class
@@ -40,14 +45,50 @@ class Pyccoon(object):
     # The end of each Pygments highlight block.
     highlight_end = "</pre></div>"
 
-    config = defaultdict(None)
-    config.update(yaml.safe_load(resources.default_config.decode("utf8")))
+    # Section names in the docs: single lines prefixed by `#`s
+    section_name_re = re.compile(r'^\s*(#\s)?\s*(#+)([^#\n]+)\s*$', re.M)
+
+    # Cross-references, and the code spans they are not looked for in
+    crossref_re = re.compile(r'(`+)[^`]*?\1|\[\[([^\|\n]+\|)?(.+?)\]\]')
+
+    # Section names once they are preprocessed, and the fenced code blocks they are not
+    # headings in. Markdown leaves the names of plain words and punctuation as they are.
+    heading_re = re.compile(r'^(#+) <a id="(.*?)" class="header-anchor" href="#\2">(.*)</a>$',
+                            re.M)
+    fence_re = re.compile(r'^(~{3,}|`{3,}).*?\n.*?(?<=\n)\1[ ]*$', re.M | re.S)
+    plain_name_re = re.compile(r"^(?!.*www)(?=.*[^\W_])(?:[^\W_]|[ ,.;:?'()!+=%@~^|-])+$", re.U)
 
     config_file = '.pyccoon.yaml'
     watch = False
+    # Seconds without changes the watch mode waits for before a build
+    watch_delay = 0.5
     verbosity = -1
 
     outdir = sourcedir = None
+    sources = None
+    tree = None
+    jobs = 1
+    incremental = False
+    # Path of the JSON timings report, the number of the slowest files and phases to print, and\
+    # the time any single file is allowed to take
+    profile = None
+    profile_top = 10
+    budget = None
+    profiler = None
+    over_budget = []
+    # Folder of the caches kept between the builds, and its size limit in megabytes
+    cache_dir = None
+    cache_size = 100
+    detected_languages = None
+    reproducible = False
+    build_time = None
+    shard = None
+
+    # Estimated cost of a source for balancing the shards and the worker processes, in bytes of
+    # source: rendering a page costs about as much as `page_cost` more bytes, and copying a file
+    # is `copy_cost_weight` times cheaper than documenting it
+    page_cost = 4096
+    copy_cost_weight = 0.1
 
     def __init__(self, opts, process=True):
         """
@@ -61,6 +102,20 @@ class Pyccoon(object):
           * `outdir` - output directory
           * `config_file` - pyccoon project settings
           * `watch` - whether to regenerate the docs automatically
+          * `watch_delay` - seconds without changes to wait for before regenerating them
+          * `jobs` - number of worker processes to render the files with
+          * `incremental` - whether to skip the files that did not change since the last build
+          * `profile` - where to save the JSON report of the time spent on every file
+          * `profile_top` - how many of the slowest files and phases to print
+          * `budget` - seconds a single file is allowed to take
+          * `cache_dir` - folder to keep the highlighted code and docs in between the builds
+          * `cache_size` - size limit of the cache, in megabytes
+          * `reproducible` - whether to date the pages by the last commit rather than the\
+            current time, if `SOURCE_DATE_EPOCH` is not set
+          * `shard` - `(index, count)`: only render the `index`-th of `count` parts of the\
+            sources, counting from 1 (see `merge`)
+          * `sources` - already collected `SourceFile`s (skips the source folder walk)
+          * `detected_languages` - `DetectedLanguages` to start with
         """
 
         for key, value in opts.items():
@@ -82,18 +137,46 @@ class Pyccoon(object):
         self.log("Source folder: " + self.sourcedir)
         self.outdir = os.path.abspath(self.outdir)
         self.log("Output folder: " + self.outdir)
+        if self.build_time is None:
+            self.build_time = self.timestamp()
 
         # Create the template that we will use to generate the Pyccoon HTML page.
         # If the user has supplied a path, we read it from there.
         if self.custom_html_template_path:
             with open(self.custom_html_template_path) as f:
-                html_template = f.read()
-            self.page_template = self.template(html_template)
+                self.html_template = f.read()
         # If not, we use the default.
         else:
-            self.page_template = self.template(resources.html)
-
-        self.collect_sources()
+            self.html_template = resources.read('html')
+        self.page_template = self.template(self.html_template)
+
+        self.highlight_cache = None
+        docs_disk_cache = None
+        if self.cache_dir:
+            # The highlighted code and the docs share the folder, and the size limit with it
+            disk_cache = DiskCache(self.cache_dir, max_size=int(self.cache_size * 1024 * 1024))
+            self.highlight_cache = disk_cache.namespace('highlight')
+            docs_disk_cache = disk_cache.namespace('docs')
+        # Identical docs (license headers, boilerplate docstrings) are converted only once
+        self.docs_cache = MemoCache(disk=docs_disk_cache)
+        # Output files are only replaced when their contents change
+        self.outputs_written = self.outputs_unchanged = 0
+
+        self.records = {}
+        # Sources a cancelled watch build left out
+        self.unfinished = set()
+        self.dependencies = DependencyGraph()
+        self.references = CrossReferences()
+        # Incremental builds still know the anchors and links of the pages they skip
+        if self.incremental:
+            self.references.load(os.path.join(self.outdir, CrossReferences.filename))
+        if self.detected_languages is None:
+            self.detected_languages = DetectedLanguages()
+            if self.incremental:
+                self.detected_languages.load(
+                    os.path.join(self.outdir, DetectedLanguages.filename))
+        if self.sources is None:
+            self.collect_sources()
 
         if process:
             self.process()
@@ -109,18 +192,50 @@ class Pyccoon(object):
                 sys.exit('The `watch` option requires the watchdog package.')
 
             from .utils import monitor
-            monitor(path=self.sourcedir,
-                    file_modified=self.process,
-                    file_changed=self.collect_n_process)
+            monitor(path=self.sourcedir, build=self.rebuild, delay=self.watch_delay)
 
     def log(self, message):
         if self.verbosity:
             print(message)
 
+    def timestamp(self):
+        """
+        ### Build time
+        The time the pages are dated by. Following https://reproducible-builds.org, it is\
+        `SOURCE_DATE_EPOCH` if it is set, and in the `reproducible` mode the time of the last\
+        commit, so that building the same sources twice gives the very same pages. Both are\
+        shown in UTC.
+        """
+        epoch = os.environ.get('SOURCE_DATE_EPOCH')
+        if not epoch and self.reproducible:
+            epoch = commit_time(self.sourcedir)
+            if epoch is None:
+                self.log("No SOURCE_DATE_EPOCH or git commit to date the pages by, using 0")
+                epoch = 0
+        if epoch is None or epoch == '':
+            return datetime.now()
+
+        try:
+            return datetime(1970, 1, 1) + timedelta(seconds=int(epoch))
+        except ValueError:
+            raise ValueError("SOURCE_DATE_EPOCH must be a number of seconds, not {0!r}"
+                             .format(epoch))
+
+    @cached_property
+    def config(self):
+        """ The default config, which `init_config` updates with the project settings """
+        import yaml
+
+        config = defaultdict(None)
+        config.update(yaml.safe_load(resources.read('default_config').decode("utf8")))
+        return config
+
     def init_config(self):
         """ Try to get `.pyccoon.yaml` config file or use the default values """
-        config_file = os.path.abspath(self.config_file)
-        if os.path.exists(config_file):
+        import yaml
+
+        config_file = self.config_file and os.path.abspath(self.config_file)
+        if config_file and os.path.exists(config_file):
             self.log('Using config {0:s}'.format(config_file))
             with open(config_file, 'rb') as f:
                 self.config.update(yaml.safe_load(f.read().decode('utf8')))
@@ -129,6 +244,7 @@ class Pyccoon(object):
 
         self.config['files']['skip'] = [re.compile(p) for p in self.config['files']['skip']]
         self.config['files']['copy'] = [re.compile(p) for p in self.config['files']['copy']]
+        self.matcher = PathMatcher(self.config['files']['skip'], self.config['files']['copy'])
 
         self.project_name = self.config['project']['name'] \
             or (os.path.split(self.sourcedir)[1] + " documentation")
@@ -163,91 +279,223 @@ class Pyccoon(object):
         return bool(bytes.translate(None, cls._textchars))
 
     def collect_sources(self):
-        """ Collect names of all files to be copied or processed """
+        """ Collect names of all files to be copied or processed. The skipped folders are not\
+            even listed. """
         self.sources = {}
-        for dirpath, dirnames, files in os.walk(self.sourcedir):
-            if any([reg.search(dirpath) for reg in self.config['files']['skip']]):
-                continue
+        self.records = {}
+        for dirpath, files in walk_sources(self.sourcedir, self.matcher.skipped):
+            for entry in files:
+                sf = self.collect_source(dirpath, entry.name, entry)
+                if sf:
+                    self.sources[sf.source] = sf
 
-            for name in files:
-                if name in dirnames or any([reg.search(name)
-                                            for reg in self.config['files']['skip']]):
-                    continue
+        self.source_tree()
 
-                # Don't copy the custom CSS file, if there is one.
-                # That file will be copied with the name specified by `resources.css_filename`.
-                if self.custom_css_path and \
-                   os.path.join(dirpath, name) == os.path.abspath(self.custom_css_path):
-                    continue
+    def collect_source(self, dirpath, name, entry=None):
+        """
+        `SourceFile` of a single file, or `None` if the file is to be skipped
+
+        :param entry: `os.DirEntry` of the file, if it was found by listing its folder
+        """
+        if self.matcher.skipped(name):
+            return None
 
-                fullpath = os.path.join(dirpath, name)
-                source = os.path.relpath(fullpath, self.sourcedir)
-                process = True
-                if any([regex.search(name) for regex in self.config['files']['copy']]):
-                    process = False
-
-                prefix = None
-                if process:
-                    with open(fullpath, 'rb') as f:
-                        prefix = f.read(1024)
-                        if self.is_binary_string(prefix):
-                            process = False
-
-                self.sources[source] = SourceFile(
-                    source=source,
-                    destination=self.destination(source, process=process),
-                    process=process,
-                    prefix=prefix
-                )
+        # Don't copy the custom CSS file, if there is one.
+        # That file will be copied with the name specified by `resources.css_filename`.
+        if self.custom_css_path and \
+           os.path.join(dirpath, name) == os.path.abspath(self.custom_css_path):
+            return None
+
+        fullpath = os.path.join(dirpath, name)
+        source = os.path.relpath(fullpath, self.sourcedir)
+        process = not self.matcher.copied(name)
+
+        record = self.record(source)
+        if entry is not None:
+            record.isfile = entry.is_file()
+
+        prefix = None
+        if process:
+            prefix = record.prefix
+            if self.is_binary_string(prefix):
+                process = False
+
+        return SourceFile(
+            source=source,
+            destination=self.destination(source, process=process),
+            process=process,
+            prefix=prefix
+        )
+
+    def source_tree(self):
+        """ `SourceTree` of the collected sources, rebuilt only if `self.sources` was replaced """
+        if self.tree is None or self.tree.sources is not self.sources:
+            self.tree = SourceTree(self.outdir, self.sources)
+        return self.tree
 
     def collect_n_process(self):
         self.collect_sources()
         self.process()
 
-    def process(self, sources=None, language=None):
+    def process(self, sources=None, language=None, cancelled=None):
         """
         ## Source files processing
 
         :param sources: `list` of source files to process
         :param language: Force programming language
+        :param cancelled: Function telling whether to stop the build before the next file
+        :return: `set` of the sources left out by a cancelled build
         """
 
         self.log('\n' + '-' * 80)
         self.log("[{0}] Generating documentation for {1}".format(datetime.now(), self.project_name))
         self.log('-' * 80 + '\n')
 
-        if sources:
-            sources = dict([(k, v) for (k, v) in self.sources.items() if k in sources])
+        if sources is not None:
+            sources = dict([(k, self.sources[k]) for k in set(sources) if k in self.sources])
         else:
             sources = self.sources
+        if self.shard:
+            sources = self.shard_sources(sources)
+
+        if self.profile or self.budget is not None:
+            self.profiler = BuildProfile()
+        self.build_time = self.timestamp()
+        self.outputs_written = self.outputs_unchanged = 0
 
         ensure_directory(self.outdir)
 
-        # Handle CSS file which is either:
-        #
-        # - built from a default template
-        # - user specified (in which case it is not a template, but a normal file
-        #     to be used verbatim.
+        # Shards leave the stylesheet and the static resources to `merge`
+        css_contents = self.render_css()
+        if not self.shard:
+            self.write_resources(css_contents)
+
+        # Proceed to generating the documentation. In the incremental mode, the sources that\
+        # did not change since the previous build (according to its manifest) are skipped.
+        # Index files are always regenerated, since their navigation depends on the neighbours.
+        manifest = entries = None
+        if self.incremental:
+            manifest = BuildManifest(self.outdir, self.fingerprint(css_contents))
+            entries = {}
+
+        tree = self.source_tree()
+        relinked = self.relinked_sources(manifest) if manifest else set()
+        pending = []
+        unchanged = 0
+        for sf in sorted(sources.values(), key=lambda x: x.destination):
+            # Generated index pages are rendered again along with the missing ones, below
+            if sf.source in tree.generated:
+                tree.reset_index(sf)
+                continue
+
+            # Static resources live outside of the source folder, `write_resources` copied them
+            if os.path.isabs(sf.source):
+                continue
+
+            if manifest:
+                entries[sf.source] = entry = self.manifest_entry(manifest, sf, language)
+                if entry and manifest.is_current(sf.source, entry) and \
+                        not self.is_index(sf.source) and sf.source not in relinked:
+                    unchanged += 1
+                    continue
+            pending.append(sf)
+
+        if manifest:
+            self.log("\tUnchanged:\t{0:d} file(s)".format(unchanged))
+
+        if self.jobs != 1:
+            processed = self.process_parallel(pending, language=language)
+        else:
+            processed = (self.process_file(sf, language=language) for sf in pending)
+
+        unfinished = set(sf.source for sf in pending)
+        for sf, error in processed:
+            self.sources[sf.source] = sf
+            unfinished.discard(sf.source)
+            tree.add(sf)
+            if manifest:
+                if error or not entries.get(sf.source):
+                    manifest.discard(sf.source)
+                else:
+                    manifest.record(sf.source, entries[sf.source])
+            if cancelled is not None and unfinished and cancelled():
+                self.log("\tCancelled:\t{0:d} file(s) left".format(len(unfinished)))
+                processed.close()
+                break
+        else:
+            unfinished = set()
+
+        if manifest:
+            # Only a full build knows which sources were removed
+            if sources is self.sources:
+                for destination in manifest.stale(self.sources):
+                    self.remove_output(destination)
+            manifest.save()
+
+        # Shards leave the index pages of the folders that have none to `merge` as well
+        if not self.shard:
+            self.generate_indexes()
+
+        self.report_references(None if sources is self.sources else sources)
+        # Every build saves the index, for the incremental builds that follow it and for `merge`
+        # to check the cross-references of all the shards together; unchanged, it's left as is
+        self.save_references()
+        if self.docs_cache.hits or self.docs_cache.misses:
+            self.log("\nDocs cache: {0:d} hits, {1:d} misses"
+                     .format(self.docs_cache.hits, self.docs_cache.misses))
+        self.log("\nOutputs: {0:d} written, {1:d} unchanged"
+                 .format(self.outputs_written, self.outputs_unchanged))
+        if self.profiler:
+            self.report_profile()
+        if self.incremental:
+            self.detected_languages.save(
+                os.path.join(self.outdir, DetectedLanguages.filename), self.sources)
+
+        self.log("...Done.")
+        return unfinished
+
+    def relinked_sources(self, manifest):
+        """
+        Sources of the pages that link to a source added, removed or rendered into another place\
+        since the previous build: their links change even if they did not. They are found by\
+        the cross-references the previous build saved.
+        """
+        tree = self.source_tree()
+        destinations = dict((source, os.path.relpath(sf.destination, self.outdir))
+                            for source, sf in self.sources.items()
+                            if not os.path.isabs(source) and source not in tree.generated)
+        previous = dict((source, entry.get('destination'))
+                        for source, entry in manifest.previous.items())
+        moved = set(source for source in set(destinations) | set(previous)
+                    if destinations.get(source) != previous.get(source))
+        return set(source for source, links in self.references.links.items()
+                   if any(target in moved for target, _ in links))
+
+    def render_css(self):
+        """
+        Contents of the stylesheet, which is either:
+
+        - built from a default template
+        - user specified (in which case it is not a template, but a normal file
+            to be used verbatim.
+        """
 
         # If the user has supplied a path, we use that file.
         if self.custom_css_path:
             with open(self.custom_css_path) as f:
-                css_contents = f.read()
+                return f.read()
+
         # Else, we use the default template.
-        else:
-            # Currently, the only configurable item in the template is the linebreaking behavior
-            # of the text in documentation sections.
-            css_contents = pystache.render(resources.css,
-                                           {'linebreaking-behavior':
-                                            self.linebreaking_behavior})
-
-        # Now that we have specified the *contents* of the file, the code is equal in both
-        # situations (*template* or *custom file*).
-        filepath = os.path.join(os.path.split(resources.__file__)[0], resources.css_filename)
+        # Currently, the only configurable item in the template is the linebreaking behavior
+        # of the text in documentation sections.
+        import pystache
+        return pystache.render(resources.read('css'),
+                               {'linebreaking-behavior': self.linebreaking_behavior})
+
+    def write_resources(self, css_contents):
+        """ Write the stylesheet and copy the static files into the output folder """
         destpath = os.path.join(self.outdir, resources.css_filename)
-
-        with open(destpath, 'w') as f:
-            f.write(css_contents)
+        self.count_output(write_file(destpath, css_contents.encode('utf8')))
 
         # Handle static files
         for filename, dest in resources.static_files:
@@ -258,83 +506,377 @@ class Pyccoon(object):
                                                 process=False,
                                                 prefix=None)
 
-            shutil.copyfile(
-                filepath,
-                destpath
-            )
-
-        # Proceed to generating the documentation.
-        for sf in sorted(sources.values(), key=lambda x: x.destination):
-
-            filepath = os.path.join(self.sourcedir, sf.source)
-            try:
-                if sf.process:
-                    with open(filepath, "rb") as f:
-                        code = f.read().decode('utf8')
-
-                    self.language = get_language(sf.source, code, language=language)
-                    self.parent = self
-                    if not self.language:
-                        self.sources[sf.source] = sf._replace(process=False)
-                        sf = self.sources[sf.source]
-
-                    try:
-                        ensure_directory(os.path.split(sf.destination)[0])
-                    except OSError:
-                        pass
-
-                if sf.process:
-                    if os.path.exists(os.path.join(self.sourcedir, sf.source)):
-                        with open(sf.destination, "wb") as f:
-                            f.write(self.generate_documentation(sf.source, code,
-                                                                language=self.language)
-                                    .encode('utf8'))
-
-                        self.log("\tProcessed:\t{0:s} -> {1:s}"
-                                 .format(sf.source, os.path.relpath(sf.destination, self.outdir)))
-                    else:
-                        self.log("File does not exist: {0:s}".format(sf.source))
-
-                else:
-                    ensure_directory(os.path.split(sf.destination)[0])
-                    shutil.copyfile(os.path.join(self.sourcedir, sf.source), sf.destination)
-                    self.log("\tCopied:   \t{0:s}".format(sf.source))
-            except Exception as e:
-                self.log("Error while processing file {0:s}: {1}".format(sf.source, e))
-
-        # Ensure there is always an index file in the output folder
-        folders = set()
-        for sf in self.sources.values():
-            folder = os.path.relpath(os.path.split(sf.destination)[0], self.outdir).lstrip('./')
-            index = os.path.join(folder, "index.html")
-            while True:
-                if not any([os.path.join(self.outdir, index) == sf.destination
-                            for sf in self.sources.values()]):
-                    folders.add(folder)
-
-                if not folder:
-                    break
-                else:
-                    folder = os.path.split(folder)[0]
+            self.count_output(copy_file(filepath, destpath))
 
-        for folder in folders:
-            source = os.path.join(folder, 'index.html')
+    def generate_indexes(self):
+        """ Ensure there is always an index file in the output folder """
+        tree = self.source_tree()
+        for folder in tree.missing_indexes():
+            source = os.path.join(folder.path, 'index.html')
             destination = os.path.join(self.outdir, source)
             self.sources[source] = \
                 SourceFile(source=source,
                            destination=destination,
                            process=False,
                            prefix=None)
+            tree.add_index(folder, self.sources[source])
+
+            self.language = Language()
+            self.write_html(destination, source, [])
+            self.log("\tGenerated:\t{0:s}".format(source))
+
+    def save_references(self):
+        self.count_output(self.references.save(
+            os.path.join(self.outdir, CrossReferences.filename),
+            dict((source, os.path.relpath(sf.destination, self.outdir))
+                 for source, sf in self.sources.items() if not os.path.isabs(source))
+        ))
+
+    # ## Sharding
+    # A build can be split between several machines: every one of them renders a part of the
+    # sources with `--shard i/N` into an output folder of its own, and then `pyccoon merge`
+    # combines those folders. All the shards collect all the sources, so the links and the
+    # navigation on their pages are the same as in a single build.
+
+    def source_cost(self, sf):
+        """ Estimated cost of processing a `SourceFile`: its size times its language weight """
+        try:
+            size = os.path.getsize(os.path.join(self.sourcedir, sf.source))
+        except OSError:
+            size = 0
 
-            with open(destination, 'w', encoding='utf8') as f:
-                self.language = Language()
-                f.write(self.generate_html(source, []))
-                self.log("\tGenerated:\t{0:s}".format(source))
+        language = self.get_language(sf.source) if sf.process else None
+        if language is None:
+            return size * self.copy_cost_weight
+        return (size + self.page_cost) * language.cost_weight
 
+    def shard_sources(self, sources):
+        """
+        The part of the `sources` this shard renders. The split is made over all the collected\
+        sources, so that every shard makes the same one. Static resources and generated index\
+        pages are left to `merge`.
+        """
+        index, count = self.shard
+        tree = self.source_tree()
+        costs = dict((source, self.source_cost(sf)) for source, sf in self.sources.items()
+                     if not os.path.isabs(source) and source not in tree.generated)
+        shard = split_shards(costs, count)[index - 1]
+        self.log("Shard {0:d}/{1:d}: {2:d} of {3:d} file(s)"
+                 .format(index, count, len(shard), len(costs)))
+        return dict((source, sf) for source, sf in sources.items() if source in shard)
+
+    def merge(self, shards):
+        """
+        Combine the output folders of the `shards` into the output folder, then do what the\
+        shards leave out: the resources, the index pages of the folders that have none, and\
+        checking the cross-references between the pages of all the shards.
+        """
+        self.log('\n' + '-' * 80)
+        self.log("[{0}] Merging {1:d} shard(s) of {2}"
+                 .format(datetime.now(), len(shards), self.project_name))
+        self.log('-' * 80 + '\n')
+
+        self.outputs_written = self.outputs_unchanged = 0
+        ensure_directory(self.outdir)
+        metadata = set([CrossReferences.filename, BuildManifest.filename,
+                        DetectedLanguages.filename])
+
+        for shard in shards:
+            shard = os.path.abspath(shard)
+            references = CrossReferences()
+            references.load(os.path.join(shard, CrossReferences.filename))
+            self.references.update(references)
+
+            for dirpath, files in walk_sources(shard, lambda path: False):
+                for entry in files:
+                    if dirpath == shard and entry.name in metadata:
+                        continue
+                    destination = os.path.join(self.outdir, os.path.relpath(entry.path, shard))
+                    ensure_directory(os.path.dirname(destination))
+                    self.count_output(copy_file(entry.path, destination))
+            self.log("\tMerged:  \t{0:s}".format(shard))
+
+        self.write_resources(self.render_css())
+        self.generate_indexes()
+        self.report_references()
+        self.save_references()
+        self.log("\nOutputs: {0:d} written, {1:d} unchanged"
+                 .format(self.outputs_written, self.outputs_unchanged))
         self.log("...Done.")
 
+    # ## Watch mode
+    # The watcher hands the changes over in batches (see [[utils.py#watch-worker]]): a single
+    # save in an editor or a `git checkout` of thousands of files ends up as one build.
+
+    def rebuild(self, changes, cancelled=None):
+        """
+        Regenerate the docs after a batch of `changes`: `dict` of the changed paths, with\
+        whether the file or folder was created or removed rather than modified. A build that\
+        is `cancelled()` stops early, and the sources it left out are built with the next batch.
+        """
+        names = [os.path.relpath(path, self.sourcedir) for path in changes]
+        self.log("\n{0:d} change(s): {1:s}{2:s}".format(len(names), ", ".join(names[:5]),
+                                                        ", ..." if len(names) > 5 else ""))
+
+        affected = set(self.unfinished)
+        for path, changed in changes.items():
+            if changed:
+                affected |= self.changed_sources(path)
+            else:
+                affected |= self.modified_sources(path)
+        self.unfinished = self.process(sources=affected, cancelled=cancelled)
+
+    def file_modified(self, path):
+        """ Regenerate a modified source file and the pages that link to it """
+        affected = self.modified_sources(path)
+        if affected:
+            self.process(sources=affected)
+
+    def file_changed(self, path):
+        """ Regenerate the docs after a file or a folder was created or removed """
+        self.process(sources=self.changed_sources(path))
+
+    def modified_sources(self, path):
+        """ A modified source file and the sources of the pages that link to it """
+        source = os.path.relpath(path, self.sourcedir)
+        if source not in self.sources:
+            return set()
+
+        self.records.pop(source, None)
+        return set([source]) | self.dependencies.dependents(source)
+
+    def changed_sources(self, path):
+        """
+        A file or a folder was created or removed (moves come as both). Update the collected\
+        sources, and return the new sources and the sources of the pages that link to or list\
+        them.
+        """
+        source = os.path.relpath(path, self.sourcedir)
+        tree = self.source_tree()
+        added, removed = [], []
+
+        skipped = self.in_skipped_folder(path)
+        if os.path.isdir(path):
+            if not skipped:
+                for dirpath, files in walk_sources(path, self.matcher.skipped):
+                    added.extend(self.collect_source(dirpath, entry.name, entry)
+                                 for entry in files)
+        elif os.path.isfile(path):
+            if not skipped:
+                added.append(self.collect_source(os.path.dirname(path),
+                                                 os.path.basename(path)))
+        else:
+            folder = tree.folder(os.path.normpath(source))
+            if folder is not None and folder.parent is not None:
+                removed = [sf for subfolder in folder.walk() for sf in subfolder.files.values()]
+            elif source in self.sources:
+                removed = [self.sources[source]]
+
+        added = [sf for sf in added if sf]
+        for sf in added:
+            self.records.pop(sf.source, None)
+            self.sources[sf.source] = sf
+            tree.add(sf)
+
+        for sf in removed:
+            del self.sources[sf.source]
+            self.records.pop(sf.source, None)
+            self.remove_output(sf.destination)
+            # Generated index pages of the folders left empty are removed too
+            for folder in tree.remove(sf):
+                index = os.path.join(folder.path, 'index.html')
+                if index in tree.generated:
+                    tree.generated.discard(index)
+                    self.remove_output(self.sources.pop(index).destination)
+
+        affected = set(sf.source for sf in added)
+        for sf in added + removed:
+            affected |= self.dependencies.dependents(sf.source, listed=True)
+        return affected
+
+    def in_skipped_folder(self, path):
+        """ Whether one of the folders the `path` is in, up to the source folder, is skipped """
+        folder = os.path.dirname(path)
+        while folder.startswith(self.sourcedir):
+            if self.matcher.skipped(folder):
+                return True
+            if folder == self.sourcedir:
+                break
+            folder = os.path.dirname(folder)
+        return False
+
+    def report_references(self, sources=None):
+        """ Report the cross-references (of the `sources` or all of them) that lead nowhere """
+        broken = self.references.broken(self.sources, linking=sources)
+        if broken:
+            self.log("\nBroken cross-references ({0:d}):".format(len(broken)))
+            for source, target, anchor in broken:
+                self.log("\t{0:s} -> {1:s}{2:s}".format(source, target,
+                                                        '#' + anchor if anchor else ''))
+
+    def report_profile(self):
+        """ Print the slowest files and phases, save the report and check the time budget """
+        self.log("")
+        for line in self.profiler.report(self.profile_top):
+            self.log(line)
+
+        if self.profile:
+            self.profiler.save(self.profile, self.budget)
+            self.log("Timings saved to {0:s}".format(self.profile))
+
+        self.over_budget = self.profiler.over_budget(self.budget) \
+            if self.budget is not None else []
+        if self.over_budget:
+            self.log("Files over the budget of {0:g}s:".format(self.budget))
+            for total, source in self.over_budget:
+                self.log("\t{0:8.3f}s  {1:s}".format(total, source))
+
+    def timed(self, source, phase):
+        """ Context manager recording the time of a `phase` of the `source` processing """
+        return Timer(self.profiler, source, phase)
+
+    def remove_output(self, destination):
+        if os.path.exists(destination):
+            os.unlink(destination)
+            self.log("\tRemoved:\t{0:s}".format(os.path.relpath(destination, self.outdir)))
+
+    def process_file(self, sf, language=None):
+        """
+        ### Processing a single file
+        Generate the documentation for (or just copy) a single `SourceFile`. Returns the\
+        `SourceFile`, updated if the file turned out to be impossible to document, and the error\
+        message if the processing failed.
+        """
+
+        error = None
+        filepath = os.path.join(self.sourcedir, sf.source)
+        record = self.record(sf.source)
+        self.references.forget(sf.source)
+        try:
+            if sf.process:
+                with self.timed(sf.source, 'read'):
+                    code = record.code
+                with self.timed(sf.source, 'detect'):
+                    if language:
+                        self.language = get_language(sf.source, code, language=language)
+                    else:
+                        self.language = record.language
+                self.parent = self
+                if not self.language:
+                    sf = sf._replace(process=False)
+
+                try:
+                    ensure_directory(os.path.split(sf.destination)[0])
+                except OSError:
+                    pass
+
+            if sf.process:
+                if os.path.exists(filepath):
+                    sections = self.stream(sf.source, code, language=self.language)
+                    self.write_html(sf.destination, sf.source, sections)
+
+                    self.log("\tProcessed:\t{0:s} -> {1:s}"
+                             .format(sf.source, os.path.relpath(sf.destination, self.outdir)))
+                else:
+                    self.log("File does not exist: {0:s}".format(sf.source))
+
+            else:
+                ensure_directory(os.path.split(sf.destination)[0])
+                self.count_output(copy_file(filepath, sf.destination))
+                self.log("\tCopied:   \t{0:s}".format(sf.source))
+        except Exception as e:
+            error = "Error while processing file {0:s}: {1}".format(sf.source, e)
+            self.log(error)
+        finally:
+            record.release()
+
+        return sf, error
+
+    def process_parallel(self, sources, language=None):
+        """
+        ### Parallel processing
+        Farm `process_file` out to a pool of `self.jobs` worker processes (`0` means "one per\
+        CPU"). Every worker keeps its own `Pyccoon` instance for the whole build, so language\
+        objects, Pygments lexers and Markdown engines stay warm between files.
+
+        The most expensive files are scheduled first: otherwise a single huge file picked up at\
+        the very end keeps the whole build waiting for one worker.
+        """
+        import multiprocessing
+
+        sources = sorted(sources, key=self.source_cost, reverse=True)
+        options = {
+            'sourcedir': self.sourcedir,
+            'outdir': self.outdir,
+            'config_file': self.config_file,
+            'sources': self.sources,
+            'profile': bool(self.profiler),
+            'cache_dir': self.cache_dir,
+            'cache_size': self.cache_size,
+            'build_time': self.build_time,
+            'detected_languages': self.detected_languages,
+        }
+
+        # A cancelled build lets the workers finish the files they are writing and skip the rest
+        cancel = multiprocessing.Event()
+        pool = multiprocessing.Pool(self.jobs or None, initializer=_init_worker,
+                                    initargs=(options, self.verbosity, cancel))
+        try:
+            for result, state in pool.imap_unordered(_process_in_worker,
+                                                     [(sf, language) for sf in sources]):
+                self.dependencies.update(state['dependencies'])
+                self.references.update(state['references'])
+                if state['profiler']:
+                    self.profiler.update(state['profiler'])
+                self.docs_cache.hits += state['docs_cache'][0]
+                self.docs_cache.misses += state['docs_cache'][1]
+                self.outputs_written += state['outputs'][0]
+                self.outputs_unchanged += state['outputs'][1]
+                yield result
+        except GeneratorExit:
+            cancel.set()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+
+    def fingerprint(self, css):
+        """ Hash of everything besides the sources themselves that the pages depend on """
+        import pygments
+        import pystache
+
+        config = json.dumps(self.config, sort_keys=True,
+                            default=lambda value: getattr(value, 'pattern', repr(value)))
+        return digest(__version__, pygments.__version__, markdown_version(),
+                      getattr(pystache, '__version__', ''),
+                      config, self.html_template, css)
+
+    def manifest_entry(self, manifest, sf, language=None):
+        """ Manifest record of a source file, or `None` if the file cannot be read """
+        record = self.record(sf.source)
+        try:
+            data = record.data
+        except (IOError, OSError):
+            return None
+
+        name = None
+        if sf.process:
+            try:
+                if language:
+                    name = get_language(sf.source, record.code, language=language).name
+                else:
+                    name = record.language.name
+            except Exception:
+                pass
+
+        # Files that have to be rebuilt are read again when it is their turn: keeping the whole
+        # source tree in memory until then is not worth saving a read.
+        record.release()
+        return manifest.entry(sf.destination, data, name)
+
     def template(self, source):
-        return lambda context: pystache.render(source, context)
+        """ Compile the page template once for the whole build """
+        return compile_template(source, engine=self.config['documentation'].get('template-engine'))
 
     def generate_documentation(self, source, code, language=None):
         """
@@ -344,39 +886,155 @@ class Pyccoon(object):
         language, and merging them into an HTML template.
         """
 
-        self.sections = language.parse(code, add_lineno=self.add_lineno)
-        language.preprocess(self.sections)
-        self.highlight(source, self.sections, language)
-        language.postprocess(self.sections)
-        return self.generate_html(source, self.sections)
+        return self.generate_html(source, self.document(source, code, language=language))
+
+    def parse(self, source, code, language):
+        """ Split the `code` up into sections """
+        with self.timed(source, 'parse'):
+            self.sections = language.parse(code, add_lineno=self.add_lineno)
+        with self.timed(source, 'preprocess'):
+            language.preprocess(self.sections)
+        return self.sections
+
+    def document(self, source, code, language):
+        """ Split the `code` up into sections and render their code and docs """
+        sections = self.parse(source, code, language)
+        with self.timed(source, 'highlight'):
+            self.highlight(source, sections, language)
+        with self.timed(source, 'postprocess'):
+            language.postprocess(sections)
+        return sections
+
+    def stream(self, source, code, language):
+        """
+        Split the `code` up into sections that are only rendered one by one, as `write_html`\
+        writes the page out (see [[templates.py#streamed-sections]]). Only whole-file steps run\
+        upfront: the docs are preprocessed, which records the anchors and the links of the page,\
+        and its contents are gathered from them.
+        """
+        sections = self.parse(source, code, language)
+        docs = self.preprocess_docs(source, sections, language)
+
+        def rendered():
+            for section in self.render_sections(source, sections, language, docs):
+                with self.timed(source, 'postprocess'):
+                    language.postprocess([section])
+                yield section
+
+        return SectionStream(sections, rendered(), self.docs_contents(language, docs))
 
     def highlight(self, source, sections, language):
+        """ Render the code and the docs of all the `sections` in place """
+        docs = self.preprocess_docs(source, sections, language)
+        sections[:] = self.render_sections(source, sections, language, docs)
+
+    def preprocess_docs(self, source, sections, language):
+        """
+        Preprocess the docs of the `sections`. The docs of the whole file are seen by the\
+        language first, so that conversions that are expensive to start (e.g. Haddock's) can be\
+        done in a single batch.
+        """
+        with self.timed(source, 'preprocess'):
+            docs = [self.preprocess(section["docs_text"],
+                                    source=os.path.join(self.sourcedir, source))
+                    for section in sections]
+        with self.timed(source, 'markdown'):
+            language.prepare_docs(docs)
+
+        self.references.set_sections(source, len(sections))
+        return docs
+
+    def render_sections(self, source, sections, language, docs):
         """
         ### Highlighting the source code
 
-        Highlights a single chunk of code using the **Pygments** module, and runs
-        the text of its corresponding comment through **Markdown**.
+        Highlights the code using the **Pygments** module, and runs the preprocessed `docs`\
+        through **Markdown**, one section at a time: copies of the `sections` with their\
+        `code_html` and `docs_html` are yielded as they are done.
 
         We process the entire file in a single call to Pygments by inserting little
         marker comments between each section and then splitting the result string
-        wherever our markers occur.
+        wherever our markers occur. Unless the output goes to the `highlight_cache`, it is\
+        split as it comes out (see `Language.highlight_pieces`).
         """
-        output = language.highlight(
-            language.divider_text.join(section["code_text"].rstrip() for section in sections)
-        )
+        code = language.divider_text.join(section["code_text"].rstrip() for section in sections)
+        if self.highlight_cache is None:
+            output = language.highlight_pieces(code)
+        else:
+            output = [self.highlight_code(language, code)]
+
+        fragments = isplit_pieces(language.divider_html, (
+            piece.replace(self.highlight_start, "").replace(self.highlight_end, "")
+            for piece in output))
 
-        output = output.replace(self.highlight_start, "").replace(self.highlight_end, "")
-        fragments = re.split(language.divider_html, output)
-        for i, section in enumerate(sections):
-            section["code_html"] = shift(fragments, "")
+        for i, (section, docs_text) in enumerate(zip(sections, docs)):
+            section = section.copy()
+            with self.timed(source, 'highlight'):
+                section["code_html"] = next(fragments, "")
             if section["code_html"]:
                 section["code_html"] = \
                     self.highlight_start + section["code_html"] + self.highlight_end
-            docs_text = section["docs_text"]
-            section["docs_html"] = language.markdown(
-                self.preprocess(docs_text, source=os.path.join(self.sourcedir, source))
-            )
+            with self.timed(source, 'markdown'):
+                section["docs_html"] = self.convert_docs(language, docs_text)
             section["num"] = i
+            yield section
+
+    def highlight_code(self, language, code):
+        """
+        Highlight the `code` with Pygments, or take it from the `highlight_cache`. The cache is\
+        keyed by everything the output depends on: the lexer, the Pygments version, the\
+        formatter and the code itself.
+        """
+        lexer = getattr(language.lexer, 'name', None)
+        if self.highlight_cache is None or lexer is None:
+            return language.highlight(code)
+
+        from pygments import __version__ as pygments_version
+
+        key = (lexer, pygments_version, 'html', code)
+        output = self.highlight_cache.get(key)
+        if output is None:
+            output = language.highlight(code)
+            self.highlight_cache.set(key, output)
+        return output
+
+    def docs_contents(self, language, docs):
+        """
+        `generate_contents` of the preprocessed `docs`, without converting them: only the\
+        section names turned into headings by `preprocess` are looked at, outside of fenced code\
+        blocks, and only the ones with more than plain words in them are converted.
+        """
+        contents = []
+        for text in docs:
+            for match in self.heading_re.finditer(self.fence_re.sub('', text)):
+                level, anchor, name = match.groups()
+                if len(level) <= 6 and self.plain_name_re.match(name):
+                    contents.append({
+                        "url": "#{0}".format(anchor),
+                        "basename": name,
+                        "level": str(len(level))
+                    })
+                else:
+                    contents += self.generate_contents(
+                        [{"docs_html": language.markdown(match.group(0))}])
+        return contents
+
+    def convert_docs(self, language, docs):
+        """
+        Convert the preprocessed `docs` with Markdown, or take them from the `docs_cache`.\
+        Preprocessing resolves the cross-references relative to the source, so the docs\
+        themselves carry all of the context the output depends on; preprocessing still runs\
+        every time, since it records the anchors and links of the page.
+        """
+        if not docs.strip():
+            return language.markdown(docs)
+
+        key = (language.markdown_signature, docs)
+        html = self.docs_cache.get(key)
+        if html is None:
+            html = language.markdown(docs)
+            self.docs_cache.set(key, html)
+        return html
 
     def preprocess(self, comment, source):
         """
@@ -388,7 +1046,7 @@ class Pyccoon(object):
         this: `[[utils.py#ensure-directory]]` which renders as
         [[utils.py#ensure-directory]]. Sections have to be manually
         declared; they are written on a single line, prefixed by `#`s:
-        `### like this`
+        `### like this`. References in code spans are left as they are.
         """
 
         def slugify(name):
@@ -396,10 +1054,13 @@ class Pyccoon(object):
             return "-".join(name.lower().strip().split(" "))
 
         def replace_crossref(match):
-            name = match.group(1)
+            if match.group(1):
+                return match.group(0)
+
+            name = match.group(2)
             if name:
                 name = name.rstrip("|")
-            path = match.group(2)
+            path = match.group(3)
 
             if not name and not path:
                 return
@@ -416,26 +1077,28 @@ class Pyccoon(object):
 
             anchor = '#' + anchor if anchor else ''
 
-            if not path.startswith('.'):
-                # Absolute reference
-                path = os.path.relpath(
-                    self.destination(path),
-                    os.path.split(self.sources[os.path.relpath(source,
-                                                               self.sourcedir)].destination)[0]
-                )
-            else:
-                # Relative reference
-                path = os.path.relpath(
-                    self.destination(os.path.join(
-                        os.path.split(os.path.relpath(source, self.sourcedir))[0], path)
-                    ),
-                    os.path.split(self.sources[os.path.relpath(source,
-                                                               self.sourcedir)].destination)[0]
-                )
+            # Absolute references are relative to the source folder, relative ones start\
+            # with a dot.
+            relsource = os.path.relpath(source, self.sourcedir)
+            if path.startswith('.'):
+                path = os.path.join(os.path.dirname(relsource), path)
+            path = os.path.normpath(path)
+
+            self.dependencies.add_link(relsource, path)
+            self.references.add_link(relsource, path, anchor[1:])
+
+            # Collected sources already know their destination
+            target = self.sources.get(path)
+            page = self.sources.get(relsource)
+            path = os.path.relpath(target.destination if target else self.destination(path),
+                                   os.path.dirname(page.destination if page
+                                                   else self.destination(relsource)))
 
             return "[{0:s}]({1:s}{2:s})".format(name, path, anchor)
 
         def replace_section_name(match):
+            self.references.add_anchor(os.path.relpath(source, self.sourcedir),
+                                       slugify(match.group(3)))
             return (
                 '\n{lvl} <a id="{id}" class="header-anchor" href="#{id}">{name}</a>'
                 .format(lvl=match.group(2), id=slugify(match.group(3)), name=match.group(3))
@@ -453,9 +1116,8 @@ class Pyccoon(object):
                     })
         """
 
-        comment = re.compile(r'^\s*(#\s)?\s*(#+)([^#\n]+)\s*$', re.M)\
-            .sub(replace_section_name, comment)
-        comment = re.sub(r'\[\[([^\|\n]+\|)?(.+?)\]\]', replace_crossref, comment)
+        comment = self.section_name_re.sub(replace_section_name, comment)
+        comment = self.crossref_re.sub(replace_crossref, comment)
         """
             comment = re.compile(r'\s*```tex(`([\w]+))?([\s\S]+)```\s*$', re.M)\
              .sub(replace_texblocks, comment)
@@ -469,30 +1131,53 @@ class Pyccoon(object):
         """
         Once all of the code is finished highlighting, we can generate the HTML file\
         and write out the documentation. Pass the completed sections into the\
-        template found in `resources/pyccoon.html`.
+        template found in `resources/pyccoon.html` (see [[templates.py]]).
+        """
+        return self.page_template(self.page_context(source, sections))
 
-        Pystache will attempt to recursively render context variables, so we must\
-        replace any occurences of `{{`, which is valid in some languages, with a\
-        "unique enough" identifier before rendering, and then post-process the\
-        rendered template and change the identifier back to `{{`.
+    def write_html(self, destination, source, sections):
         """
+        Render the page into the `destination` file chunk by chunk. With the `stream` of the\
+        sections, every section is rendered only when its turn comes, so the page is never held\
+        in memory whole (see [[templates.py]]). The file is only replaced if the page changed\
+        (see [[output.py]]).
+        """
+        with self.timed(source, 'render'), OutputFile(destination) as f:
+            for chunk in self.page_template.chunks(self.page_context(source, sections)):
+                chunk = chunk.encode('utf8')
+                with self.timed(source, 'write'):
+                    f.write(chunk)
+        self.count_output(f.changed)
+
+    def count_output(self, changed):
+        if changed:
+            self.outputs_written += 1
+        else:
+            self.outputs_unchanged += 1
+
+    def page_context(self, source, sections):
+        """ Template context of the `source` page """
 
         dest = self.destination(source)
-        title = os.path.relpath(source, self.sourcedir)
-        page_title = self.project_name + ": " + os.path.relpath(source, self.sourcedir).lstrip('./')
+        page_title = self.project_name + ": " + os.path.normpath(source)
         csspath = os.path.relpath(os.path.join(self.outdir, resources.css_filename),
                                   os.path.split(dest)[0])
 
-        breadcrumbs, filename = self.generate_breadcrumbs(dest, title)
+        breadcrumbs, filename = self.generate_breadcrumbs(source, dest)
         children = self.generate_navigation(source)
-        contents = self.generate_contents(sections)
+        if isinstance(sections, SectionStream):
+            contents = sections.contents
+            texts = sections.sections
+        else:
+            contents = self.generate_contents(sections)
+            texts = sections
 
-        for section in sections:
+        for section in texts:
             section['line_count'] = (section['code_text'].rstrip('\n') + '\n').count('\n')
             section['linenos'] = '\n'.join(str(section['line'] + i)
                                            for i in range(section['line_count']))
 
-        rendered = self.page_template({
+        return {
             "title":            page_title,
             "breadcrumbs":      breadcrumbs,
             "filename":         filename,
@@ -503,85 +1188,76 @@ class Pyccoon(object):
             "contents":         contents,
             "contents?":        bool(contents),
             "destination":      dest,
-            "generation_time":  datetime.now().strftime('%Y-%m-%d %H:%M'),
+            "generation_time":  self.build_time.strftime('%Y-%m-%d %H:%M'),
             "root_path":        os.path.relpath(".", os.path.split(source)[0]),
             "project_name":     self.project_name,
             "mathjax?":          self.config['documentation']['mathjax'],
-            "docs_only?": not any(section['code_text'] for section in sections)
-        })
-
-        return rendered.replace("__DOUBLE_OPEN_STACHE__", "{{")
+            "docs_only?": not any(section['code_text'] for section in texts)
+        }
 
-    def generate_breadcrumbs(self, dest, title):
+    def generate_breadcrumbs(self, source, dest):
         """
         ### Generating breadcrumbs
-        Based on the source file path, generate linked breadcrumbs of the documentation.
+        Based on the source file path, generate linked breadcrumbs of the documentation: one\
+        for every folder above the file, except the root one.
         """
-        breadcrumbs = []
-        crumbpath = None
-
-        dest_chunks = os.path.relpath(dest, self.outdir).split("/")
-        source_chunks = title.split("/")
-        dest_chunks.reverse()
-        source_chunks.reverse()
-
-        for i, crumb in enumerate(dest_chunks):
-
-            crumbpath = os.path.join(crumbpath, "..") if crumbpath else crumb
+        source = os.path.normpath(source)
+        folder = self.source_tree().folder(os.path.dirname(source))
+        if folder is not None:
+            names = []
+            while folder.parent is not None:
+                names.append(folder.name)
+                folder = folder.parent
+        else:
+            names = [name for name in reversed(os.path.dirname(source).split(os.sep)) if name]
 
+        breadcrumbs = []
+        crumbpath = os.path.basename(dest)
+        for name in names:
+            crumbpath = os.path.join(crumbpath, "..")
             breadcrumbs.insert(0, {
-                "title": source_chunks[i],
-                "path": crumbpath if crumbpath.endswith('.html')
-                else os.path.join(crumbpath, 'index.html')
+                "title": name,
+                "path": os.path.join(crumbpath, 'index.html')
             })
 
-        return breadcrumbs[:-1], source_chunks[0]
+        return breadcrumbs, os.path.basename(source)
+
+    index_names = [r'__init__\..+', r'index\..+']
+
+    def is_index(self, source):
+        """ Whether the source file is an index of its folder and therefore lists its contents """
+        basename = os.path.basename(source)
+        return any([re.match(regex, basename) for regex in self.index_names])
 
     def generate_navigation(self, source):
         """
         ### Generating navigation
-        For `index.html` files, generate a menu of folder contents.
+        For `index.html` files, generate a menu of folder contents: subfolders first, then files,\
+        both sorted by name.
 
         TODO: remove language dependency
         """
-        index_names = [r'__init__\..+', r'index\..+']
-        basename = os.path.basename(source)
-        if not any([re.match(regex, basename) for regex in index_names]):
+        if not self.is_index(source):
             return []
 
-        children = []
-        folder = os.path.split(os.path.join(self.sourcedir, source))[0]
-        relfolder = os.path.relpath(folder, self.sourcedir)
-        outfolder = os.path.join(self.outdir, relfolder) if relfolder != "." else self.outdir
-        for filename in os.listdir(folder):
-            if not any([regex.search(filename) for regex in self.config['files']['skip']]):
-                isdir = False
-                filepath = None
-
-                if os.path.isdir(os.path.join(folder, filename)):
-                    isdir = True
-                    filepath = os.path.join(filename, "index.html")
-                else:
-
-                    if filename in index_names:
-                        filepath = "index.html"
-                    else:
-                        in_sources = self.sources.get(
-                            os.path.join(relfolder, filename)
-                            if relfolder != "." else filename
-                        )
-
-                        if in_sources:
-                            filepath = in_sources.destination[len(outfolder)+1:]
-
-                if filepath:
-                    children.append({
-                        "title": filename,
-                        "path": filepath,
-                        "isdir": isdir
-                    })
+        folder = self.source_tree().folder(os.path.dirname(os.path.normpath(source)))
+        if folder is None:
+            return []
 
-        return sorted(children, key=lambda x: not x['isdir'])
+        self.dependencies.add_listing(source, folder.path)
+        outfolder = os.path.join(self.outdir, folder.path)
+        children = [{
+            "title": name,
+            "path": os.path.join(name, "index.html"),
+            "isdir": True
+        } for name in sorted(folder.folders)]
+        children += [{
+            "title": filename,
+            "path": os.path.relpath(sf.destination, outfolder),
+            "isdir": False
+        } for filename, sf in sorted(folder.files.items())]
+
+        return children
 
     def generate_contents(self, sections):
         """
@@ -591,8 +1267,6 @@ class Pyccoon(object):
         contents = []
 
         for section in sections:
-            section["code_html"] = section["code_html"].replace("{{", "__DOUBLE_OPEN_STACHE__")
-
             for match in re.finditer(r'<h(\d)>(.+href=\"#(.+)\".+)</h(\d)>',
                                      section["docs_html"], re.M):
 
@@ -605,41 +1279,121 @@ class Pyccoon(object):
 
     # ## Utilities
 
+    def record(self, source):
+        """ Shared `SourceRecord` of the source file """
+        source = os.path.normpath(source)
+        try:
+            return self.records[source]
+        except KeyError:
+            record = self.records[source] = \
+                SourceRecord(source, os.path.join(self.sourcedir, source), self.detect_language)
+            return record
+
     def destination(self, source, language=None, process=True):
         """
         Compute the destination HTML path for an input source file path. If the
         source is `lib/example.py`, the HTML will be at `docs/lib/example.html`
         """
 
+        record = self.record(source)
+        forced = language
+        if process and not forced and record.destination:
+            return record.destination
+
         dirname, filename = os.path.split(source)
         if process:
-            language = language or self.get_language(source)
+            language = language or record.language
 
         name = language.transform_filename(filename) if language else filename
-        return os.path.normpath(os.path.join(self.outdir, os.path.join(dirname, name)))
+        destination = os.path.normpath(os.path.join(self.outdir, os.path.join(dirname, name)))
+        # The first destination computed for the file is the one it was collected with
+        if not forced and not record.destination:
+            record.destination = destination
+        return destination
 
     def get_language(self, source):
         """ Determine language of the file """
+        return self.record(source).language
+
+    def detect_language(self, record):
+        """ Detect the language of a `SourceRecord`. Reads the file only if its name is not\
+            enough, and remembers the language detected by the hash of the contents. """
         language = None
 
-        try:
-            with open(os.path.join(self.sourcedir, source), "rb") as sourcefile:
-                code = sourcefile.read().decode('utf8')
+        # Links to missing files are left as they are
+        if not record.isfile:
+            return None
 
-            language = get_language(source, code)
+        try:
+            language = get_language(record.source, None)
+            if language is None:
+                content_hash = digest(record.data)
+                name = self.detected_languages.get(record.source, content_hash, default=False)
+                if name is False:
+                    language = get_language(record.source, record.code)
+                    self.detected_languages.set(record.source, content_hash,
+                                                language and language.name)
+                elif name:
+                    language = get_language(record.source, None, language=name)
             language.parent = self
             language.root = self.sourcedir
-            language.source = source
+            language.source = record.source
         except Exception:
             pass
 
         return language
 
 
+# ## Worker processes
+# Each process of the `Pyccoon.process_parallel` pool holds a single `Pyccoon` instance.
+
+_worker = _cancel = _error = None
+
+
+def _init_worker(opts, verbosity, cancel):
+    global _worker, _cancel, _error
+    _cancel = cancel
+    # A failing initializer makes the pool start new workers over and over again, so the error
+    # is reported by the tasks instead
+    try:
+        # Do not repeat the greeting in every worker
+        _worker = Pyccoon(dict(opts, verbosity=0), process=False)
+        _worker.verbosity = verbosity
+    except Exception as e:
+        _error = "Error while starting a worker: {0}".format(e)
+
+
+def _process_in_worker(args):
+    sf, language = args
+    if _error:
+        raise RuntimeError(_error)
+    if _cancel.is_set():
+        return (sf, None), None
+    # Send everything recorded while processing the file back with the result: the dependencies,
+    # cross-references, timings, and docs cache and output counters
+    _worker.dependencies = DependencyGraph()
+    _worker.references = CrossReferences()
+    _worker.profiler = BuildProfile() if _worker.profile else None
+    hits, misses = _worker.docs_cache.hits, _worker.docs_cache.misses
+    written, unchanged = _worker.outputs_written, _worker.outputs_unchanged
+
+    result = _worker.process_file(sf, language=language)
+    return result, {
+        'dependencies': _worker.dependencies,
+        'references': _worker.references,
+        'profiler': _worker.profiler,
+        'docs_cache': (_worker.docs_cache.hits - hits, _worker.docs_cache.misses - misses),
+        'outputs': (_worker.outputs_written - written, _worker.outputs_unchanged - unchanged),
+    }
+
+
 def main():
     """Hook spot for the console script."""
 
-    parser = optparse.OptionParser(version='Pyccoon {0}'.format(__version__))
+    parser = optparse.OptionParser(
+        usage="%prog [options]\n       %prog merge [options] SHARD_FOLDER...\n"
+              "       %prog serve [options]",
+        version='Pyccoon {0}'.format(__version__))
     parser.add_option('-s', '--source', action='store', type='string',
                       dest='sourcedir', default='.',
                       help='Source files directory (default: `%default`)')
@@ -651,6 +1405,18 @@ def main():
     parser.add_option('-w', '--watch', action='store_true',
                       help='Watch original files and regenerate documentation on changes')
 
+    parser.add_option('--watch-delay', action='store', dest='watch_delay',
+                      default=0.5, type='float',
+                      help='Seconds without changes to wait for before regenerating the '
+                           'documentation in the watch mode (default: %default)')
+
+    parser.add_option('-j', '--jobs', action='store', dest='jobs',
+                      default=1, type='int',
+                      help='Number of worker processes, 0 for one per CPU (default: %default)')
+
+    parser.add_option('-i', '--incremental', action='store_true',
+                      help='Skip the files that did not change since the previous build')
+
     parser.add_option('-c', '--config', action='store', dest='config_file',
                       default=os.path.join(os.getcwd(), '.pyccoon.yaml'), type='string',
                       help='Config file to use (default: `%default`)')
@@ -659,10 +1425,75 @@ def main():
                       default=-1, type='int',
                       help='Terminal output verbosity (0 to 1; default: %default)')
 
-    opts, _ = parser.parse_args()
+    parser.add_option('--profile', action='store', dest='profile', type='string',
+                      help='Time every phase of the processing of every file and save the report'
+                           ' to this JSON file')
+
+    parser.add_option('--profile-top', action='store', dest='profile_top',
+                      default=10, type='int',
+                      help='Number of the slowest files and phases to print (default: %default)')
+
+    parser.add_option('--budget', action='store', dest='budget', type='float',
+                      help='Fail when processing a single file takes longer (in seconds)')
+
+    parser.add_option('--cache', action='store', dest='cache_dir', type='string',
+                      help='Keep the highlighted code in this folder between the builds')
+
+    parser.add_option('--cache-size', action='store', dest='cache_size',
+                      default=100, type='float',
+                      help='Size limit of the cache, and of the pages `serve` keeps in memory, '
+                           'in megabytes (default: %default)')
+
+    parser.add_option('--reproducible', action='store_true', dest='reproducible',
+                      help='Date the pages by the last git commit instead of the current time '
+                           '(SOURCE_DATE_EPOCH takes precedence), so that the same sources '
+                           'always give byte-identical output')
+
+    parser.add_option('--shard', action='store', dest='shard', type='string',
+                      help='Only render the I-th of N equal parts of the sources, given as I/N; '
+                           'combine the output folders of all the parts with `merge`')
+
+    parser.add_option('--bind', action='store', dest='host', default='127.0.0.1', type='string',
+                      help='Address `serve` listens on (default: %default)')
+
+    parser.add_option('--port', action='store', dest='port', default=8000, type='int',
+                      help='Port `serve` listens on (default: %default)')
+
+    args = sys.argv[1:]
+    command = args.pop(0) if args and args[0] in ('merge', 'serve') else None
+    opts, shards = parser.parse_args(args)
     opts = defaultdict(lambda: None, vars(opts))
 
-    Pyccoon(opts)
+    if opts['jobs'] < 0:
+        parser.error("--jobs must be 0 (one per CPU) or more")
+
+    if opts['shard']:
+        try:
+            index, count = [int(number) for number in opts['shard'].split('/')]
+        except ValueError:
+            parser.error("--shard must be given as I/N, e.g. 1/4")
+        if not 1 <= index <= count:
+            parser.error("--shard I/N needs 1 <= I <= N")
+        opts['shard'] = (index, count)
+
+    if command == 'merge':
+        if not shards:
+            parser.error("merge needs the output folders of the shards")
+        Pyccoon(opts, process=False).merge(shards)
+        return
+
+    if command == 'serve':
+        from .server import serve
+        # Pages are rendered from the current sources on every request anyway
+        opts['watch'] = False
+        serve(Pyccoon(opts, process=False), host=opts['host'], port=opts['port'],
+              max_size=int(opts['cache_size'] * 1024 * 1024))
+        return
+
+    pyccoon = Pyccoon(opts)
+    if pyccoon.over_budget:
+        sys.exit("{0:d} file(s) took longer than the budget of {1:g}s"
+                 .format(len(pyccoon.over_budget), pyccoon.budget))
 
 # Run the script.
 if __name__ == "__main__":
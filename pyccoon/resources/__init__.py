@@ -1,18 +1,29 @@
 """
-Read Pycco static resources into module variables
+Pycco static resources
+
+The files are only read when they are first used: `read('html')`, `read('css')` and\
+`read('default_config')`, or the attributes of the same names.
 """
 import os
+import sys
+import types
 
 realpath = os.path.realpath(__file__)
 
-with open(os.path.join(os.path.dirname(realpath), "pycco.html"), 'rb') as f:
-    html = f.read()
+files = {
+    'html': "pycco.html",
+    'css': "pycco.css",
+    'default_config': "default_config.yaml",
+}
+contents = {}
 
-with open(os.path.join(os.path.dirname(realpath), "pycco.css"), 'rb') as f:
-    css = f.read()
 
-with open(os.path.join(os.path.dirname(realpath), "default_config.yaml"),'rb') as f:
-    default_config = f.read()
+def read(name):
+    """ Contents of one of the `files`, as bytes """
+    if name not in contents:
+        with open(os.path.join(os.path.dirname(realpath), files[name]), 'rb') as f:
+            contents[name] = f.read()
+    return contents[name]
 
 
 css_filename = 'pyccoon.css'
@@ -21,3 +32,21 @@ static_files = [
     ('pyccoon.svg', 'pyccoon.svg'),
     ('pyccoon_icon.svg', 'pyccoon_icon.svg')
 ]
+
+
+class LazyResources(types.ModuleType):
+    """
+    The module, with the `files` as attributes read on first access. A module-level\
+    `__getattr__` would need Python 3.7, so the module replaces itself with this one.
+    """
+
+    def __getattr__(self, name):
+        if name not in files:
+            raise AttributeError("module {0!r} has no attribute {1!r}".format(self.__name__, name))
+        return read(name)
+
+
+# The original module is kept, its functions still use its globals
+module = sys.modules[__name__]
+sys.modules[__name__] = LazyResources(__name__, __doc__)
+sys.modules[__name__].__dict__.update(module.__dict__)
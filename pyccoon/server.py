@@ -0,0 +1,228 @@
+"""
+## Documentation server
+
+`pyccoon serve` renders the pages on demand instead of building them all upfront, which for a\
+huge repository saves rendering thousands of pages nobody reads. The sources are collected as\
+for a build, and every request path is mapped back to its source: the reverse of\
+`Pyccoon.destination`.
+
+A page is rendered on its first request and kept in a size-bounded LRU, keyed by the hash of\
+its source, so that an edited file is rendered again on the next request while the unchanged\
+ones are served straight from memory. The stylesheet, the static resources and the generated\
+index pages of the folders are kept in memory as well. Every request is logged with its latency\
+and with where its response came from.
+"""
+
+import mimetypes
+import os
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import unquote, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urllib import unquote
+    from urlparse import urlsplit
+
+from . import __version__, resources
+from .cache import MemoCache
+from .manifest import digest
+from .utils import SourceFile
+
+html_type = 'text/html; charset=utf-8'
+
+
+class DocumentationServer(object):
+    """
+    ### Pages by their paths
+    Everything the server knows about the documentation of a `Pyccoon` project, which is\
+    created with `process=False`.
+    """
+
+    # New files are only looked for when an unknown path is requested, and not more often than
+    # this many seconds
+    refresh_interval = 2
+
+    def __init__(self, pyccoon, max_size=100 * 1024 * 1024):
+        self.pyccoon = pyccoon
+        self.pages = MemoCache(max_size=max_size)
+
+        # The stylesheet and the static resources never change while serving
+        self.resources = {
+            resources.css_filename: (pyccoon.render_css().encode('utf8'), 'text/css')
+        }
+        for filename, dest in resources.static_files:
+            with open(os.path.join(os.path.dirname(resources.__file__), filename), 'rb') as f:
+                self.resources[dest] = (f.read(), self.content_type(dest))
+
+        self.refreshed = time.time()
+        self.route()
+
+    def url(self, destination):
+        """ Path of a page relative to the root of the documentation, with forward slashes """
+        return os.path.relpath(destination, self.pyccoon.outdir).replace(os.sep, '/')
+
+    def route(self):
+        """ Map the paths of the pages to their `SourceFile`s, and add the index pages of the\
+            folders that have no index file """
+        pyccoon = self.pyccoon
+        tree = pyccoon.source_tree()
+        self.routes = dict((self.url(sf.destination), sf) for source, sf in pyccoon.sources.items()
+                           if not os.path.isabs(source))
+        for folder in tree.missing_indexes():
+            source = os.path.join(folder.path, 'index.html')
+            sf = SourceFile(source=source,
+                            destination=os.path.join(pyccoon.outdir, source),
+                            process=False)
+            tree.add_index(folder, sf)
+            self.routes[self.url(sf.destination)] = sf
+        # Generated index pages only depend on the tree of the sources
+        self.indexes = {}
+
+    def refresh(self):
+        """ Collect the sources again, to find the files created since """
+        if time.time() - self.refreshed < self.refresh_interval:
+            return
+        routes = self.routes
+        self.pyccoon.collect_sources()
+        self.route()
+        self.refreshed = time.time()
+        # The navigation on the index pages lists the files of their folders
+        if set(routes) != set(self.routes):
+            self.pages = MemoCache(max_size=self.pages.max_size)
+
+    def folder(self, path):
+        """ Whether the `path` is a folder, which has to be requested with a trailing slash """
+        return bool(path) and not path.endswith('/') and (path + '/index.html') in self.routes
+
+    def get(self, path):
+        """
+        The response to the request of the URL `path`: `(body, content type, origin)`, where\
+        the origin is one of `memory`, `cached`, `rendered` and `file`. `None` if there is no\
+        such page.
+        """
+        path = path.lstrip('/')
+        if not path or path.endswith('/'):
+            path += 'index.html'
+
+        if path in self.resources:
+            body, content_type = self.resources[path]
+            return body, content_type, 'memory'
+
+        sf = self.routes.get(path)
+        if sf is None:
+            self.refresh()
+            sf = self.routes.get(path)
+            if sf is None:
+                return None
+
+        if sf.source in self.pyccoon.source_tree().generated:
+            return self.index(sf.source) + ('memory',)
+        if sf.process:
+            result = self.document(sf.source)
+            if result is not None:
+                return result
+
+        with open(os.path.join(self.pyccoon.sourcedir, sf.source), 'rb') as f:
+            return f.read(), self.content_type(path), 'file'
+
+    def index(self, source):
+        """ Generated index page of a folder """
+        if source not in self.indexes:
+            self.indexes[source] = \
+                (self.pyccoon.generate_html(source, []).encode('utf8'), html_type)
+        return self.indexes[source]
+
+    def document(self, source):
+        """ Documentation page of a source, rendered if the source changed since it was last.\
+            `None` if the source cannot be documented. """
+        pyccoon = self.pyccoon
+        record = pyccoon.record(source)
+        try:
+            key = (source, digest(record.data))
+            page = self.pages.get(key)
+            if page is not None:
+                return page, html_type, 'cached'
+
+            language = record.language
+            if language is None:
+                return None
+
+            pyccoon.references.forget(source)
+            page = pyccoon.generate_documentation(source, record.code, language).encode('utf8')
+            self.pages.set(key, page)
+            return page, html_type, 'rendered'
+        finally:
+            record.release()
+
+    @staticmethod
+    def content_type(path):
+        return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Handler of the requests to a `DocumentationServer`, which is the `documentation` of the\
+        HTTP server """
+
+    server_version = 'Pyccoon/' + __version__
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def respond(self, body):
+        start = time.time()
+        documentation = self.server.documentation
+        path = unquote(urlsplit(self.path).path)
+
+        if documentation.folder(path.lstrip('/')):
+            status, origin = 301, 'redirect'
+            self.send_response(status)
+            self.send_header('Location', path + '/')
+            self.end_headers()
+        else:
+            try:
+                result = documentation.get(path)
+            except Exception as e:
+                result = ('Error while rendering {0:s}: {1}'.format(path, e).encode('utf8'),
+                          'text/plain; charset=utf-8', 'error')
+                status = 500
+            else:
+                status = 404 if result is None else 200
+                if result is None:
+                    result = (b'Not found', 'text/plain; charset=utf-8', 'missing')
+
+            content, content_type, origin = result
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            if body:
+                self.wfile.write(content)
+
+        self.log_message('"%s" %d %.1fms %s', self.requestline, status,
+                         (time.time() - start) * 1000, origin)
+
+    def log_request(self, code='-', size='-'):
+        """ Requests are logged by `respond`, with their latency """
+
+    def log_message(self, format, *args):
+        self.server.documentation.pyccoon.log(
+            "[{0:s}] {1:s}".format(self.log_date_time_string(), format % args))
+
+
+def serve(pyccoon, host='127.0.0.1', port=8000, max_size=100 * 1024 * 1024):
+    """ Serve the documentation of the `pyccoon` project until interrupted """
+    httpd = HTTPServer((host, port), RequestHandler)
+    httpd.documentation = DocumentationServer(pyccoon, max_size=max_size)
+    pyccoon.log("Serving {0:s} at http://{1:s}:{2:d}/"
+                .format(pyccoon.project_name, host, httpd.server_port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,247 @@
+"""
+## Page templates
+
+Page templates are compiled once per build. Two engines are available:
+
+pystache:  the default, full-featured [Mustache](https://mustache.github.io/) implementation
+simple:    a small non-recursive engine built into Pyccoon. It supports variables, sections,\
+           inverted sections and comments, which is everything the default template needs.
+
+Both write the pages out piece by piece: the part of the page before the sections, every\
+section, and the part after them. The sections of a page written by `Pyccoon.write_html` are a\
+`SectionStream`, whose HTML is only built as the template reaches every section, so neither the\
+page nor all of its highlighted code is ever held whole. The pystache engine can only do that\
+for templates that go through the `sections` once, in a single `{{#sections}}` block like the\
+default one; other templates are rendered whole.
+"""
+
+import re
+
+try:
+    from html import escape as _escape
+except ImportError:
+    from cgi import escape as _escape
+
+
+def escape(text):
+    return _escape(text, quote=True)
+
+
+def compile_template(source, engine=None):
+    """ Compile the template `source` with one of the template engines """
+    if isinstance(source, bytes):
+        source = source.decode('utf8')
+
+    if not engine or engine == 'pystache':
+        return PystacheTemplate(source)
+    elif engine == 'simple':
+        return Template(source)
+    else:
+        raise ValueError("Unknown template engine: " + engine)
+
+
+def standalone(source, start, end, position=0):
+    """
+    Span of the tag at `start:end` with the rest of its line, if it stands alone on it: such\
+    section tags and comments take the whole line away. The line has to start after `position`.
+    """
+    line_start = source.rfind("\n", 0, start) + 1
+    line_end = source.find("\n", end)
+    line_end = len(source) if line_end == -1 else line_end + 1
+    if not source[line_start:start].strip() and not source[end:line_end].strip() \
+            and line_start >= position:
+        return line_start, line_end
+    return start, end
+
+
+class SectionStream(object):
+    """
+    ### Streamed sections
+    The `sections` of a page, whose HTML is only built as the template goes through them: the\
+    `rendered` sections are an iterator, so the template can only go through them once. The\
+    `contents` of the page are gathered beforehand.
+    """
+
+    def __init__(self, sections, rendered, contents):
+        self.sections = sections
+        self.rendered = rendered
+        self.contents = contents
+
+    def __iter__(self):
+        return self.rendered
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __bool__(self):
+        return bool(self.sections)
+
+    __nonzero__ = __bool__
+
+
+class PystacheTemplate(object):
+    """
+    ### Pystache template
+
+    Pystache will attempt to recursively render context variables, so we must replace any\
+    occurences of `{{`, which is valid in some languages, with a "unique enough" identifier\
+    before rendering, and then post-process the rendered template and change the identifier\
+    back to `{{`.
+    """
+
+    stache = "__DOUBLE_OPEN_STACHE__"
+
+    # Tags of the `sections` variable
+    sections_re = re.compile(r"\{\{\{?\s*([#^/&]?)\s*sections[\s.}]")
+
+    def __init__(self, source):
+        import pystache
+
+        self.parsed = pystache.parse(source)
+        self.renderer = pystache.Renderer()
+        self.parts = self.split(source)
+
+    def split(self, source):
+        """
+        Parse the template in three parts: before the `{{#sections}}` block, the block itself\
+        and after it. `None` if the template uses the `sections` otherwise, or changes the\
+        delimiters of the tags.
+        """
+        import pystache
+
+        tags = list(self.sections_re.finditer(source))
+        if "{{=" in source or [tag.group(1) for tag in tags] != ["#", "/"]:
+            return None
+
+        start = source.index("}}", tags[0].start()) + 2
+        open_start, open_end = standalone(source, tags[0].start(), start)
+        end = source.index("}}", tags[1].start()) + 2
+        close_start, close_end = standalone(source, tags[1].start(), end, open_end)
+        return (pystache.parse(source[:open_start]),
+                pystache.parse(source[open_end:close_start]),
+                pystache.parse(source[close_end:]))
+
+    def escape_code(self, section):
+        """ Copy of the `section` with the `{{` of its code hidden from pystache """
+        section = section.copy()
+        section['code_html'] = section['code_html'].replace("{{", self.stache)
+        return section
+
+    def __call__(self, context):
+        sections = [self.escape_code(section) for section in context.get('sections', [])]
+        context = dict(context, sections=sections)
+        return self.renderer.render(self.parsed, context).replace(self.stache, "{{")
+
+    def chunks(self, context):
+        """ Render the page section by section, or whole if the template cannot be split """
+        if self.parts is None:
+            yield self(context)
+            return
+
+        head, block, tail = self.parts
+        yield self.renderer.render(head, context).replace(self.stache, "{{")
+        for section in context.get('sections', []):
+            yield self.renderer.render(block, context,
+                                       self.escape_code(section)).replace(self.stache, "{{")
+        yield self.renderer.render(tail, context).replace(self.stache, "{{")
+
+
+class Template(object):
+    """
+    ### Simple template
+
+    The template is parsed into a tree of nodes once, and rendering just walks the tree. The\
+    values are never rendered as templates themselves, so the code needs no escaping.
+    """
+
+    tag_re = re.compile(r"\{\{(\{)?\s*([#^/!&]?)\s*(.*?)\s*\}?\}\}", re.S)
+
+    def __init__(self, source):
+        self.nodes = self.parse(source)
+
+    def parse(self, source):
+        """ Turn the template into a tree of `(kind, value, children)` nodes """
+        root = []
+        stack = [(None, root)]
+        position = 0
+
+        for match in self.tag_re.finditer(source):
+            triple, sigil, name = match.groups()
+            start, end = match.span()
+
+            if sigil and sigil in "#^/!":
+                start, end = standalone(source, start, end, position)
+
+            if source[position:start]:
+                stack[-1][1].append(('text', source[position:start], None))
+            position = end
+
+            if sigil in ("#", "^"):
+                children = []
+                stack[-1][1].append(('section' if sigil == "#" else 'inverted', name, children))
+                stack.append((name, children))
+            elif sigil == "/":
+                if stack[-1][0] != name:
+                    raise ValueError("Unexpected section end tag: " + name)
+                stack.pop()
+            elif sigil == "!":
+                pass
+            else:
+                stack[-1][1].append(('raw' if triple or sigil == "&" else 'variable', name, None))
+
+        if len(stack) > 1:
+            raise ValueError("Unclosed section: " + stack[-1][0])
+
+        if source[position:]:
+            root.append(('text', source[position:], None))
+        return root
+
+    def __call__(self, context):
+        return "".join(self.chunks(context))
+
+    def chunks(self, context):
+        """ Render the template piece by piece """
+        return self.render(self.nodes, [context])
+
+    def render(self, nodes, stack):
+        for kind, value, children in nodes:
+            if kind == 'text':
+                yield value
+            elif kind == 'variable' or kind == 'raw':
+                value = self.lookup(stack, value)
+                if value is not None:
+                    value = value if isinstance(value, type(u"")) else u"{0}".format(value)
+                    yield escape(value) if kind == 'variable' else value
+            else:
+                value = self.lookup(stack, value)
+                if kind == 'inverted':
+                    if not value:
+                        for chunk in self.render(children, stack):
+                            yield chunk
+                elif isinstance(value, (list, tuple, SectionStream)):
+                    for item in value:
+                        for chunk in self.render(children, stack + [item]):
+                            yield chunk
+                elif value:
+                    for chunk in self.render(children, stack + [value]):
+                        yield chunk
+
+    @staticmethod
+    def lookup(stack, name):
+        """ Find the value of a (possibly dotted) `name` in the context `stack` """
+        if name == ".":
+            return stack[-1]
+
+        parts = name.split(".")
+        for frame in reversed(stack):
+            if isinstance(frame, dict) and parts[0] in frame:
+                value = frame[parts[0]]
+                break
+        else:
+            return None
+
+        for part in parts[1:]:
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
@@ -0,0 +1,113 @@
+"""
+## Build profile
+
+Wall time spent on every source, split by the phase of the processing. Phases can be nested\
+(e.g. the Markdown conversion happens while highlighting); each one is only charged for its own\
+time, not for the time of the phases inside of it.
+"""
+
+import json
+import timeit
+from io import open
+
+
+class BuildProfile(object):
+
+    phases = ['read', 'detect', 'parse', 'preprocess', 'highlight', 'markdown', 'postprocess',
+              'render', 'write']
+
+    def __init__(self):
+        # `{source: {phase: seconds}}`
+        self.files = {}
+        self.running = []
+
+    def start(self, source, phase):
+        self.running.append([source, phase, timeit.default_timer(), 0.0])
+
+    def stop(self):
+        source, phase, start, nested = self.running.pop()
+        elapsed = timeit.default_timer() - start
+        self.add(source, phase, elapsed - nested)
+        if self.running:
+            self.running[-1][3] += elapsed
+
+    def add(self, source, phase, seconds):
+        timings = self.files.setdefault(source, {})
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def update(self, other):
+        """ Merge another profile in, e.g. the one recorded by a worker process """
+        for source, timings in other.files.items():
+            for phase, seconds in timings.items():
+                self.add(source, phase, seconds)
+
+    def total(self, source):
+        return sum(self.files[source].values())
+
+    def slowest(self, count):
+        """ `count` sources that took the most time, as `(total, source)` tuples """
+        return sorted(((self.total(source), source) for source in self.files),
+                      reverse=True)[:count]
+
+    def by_phase(self):
+        """ Total time of every phase """
+        totals = dict((phase, 0.0) for phase in self.phases)
+        for timings in self.files.values():
+            for phase, seconds in timings.items():
+                totals[phase] = totals.get(phase, 0.0) + seconds
+        return totals
+
+    def over_budget(self, budget):
+        """ Sources that took longer than `budget` seconds, as `(total, source)` tuples """
+        return [(total, source) for total, source in self.slowest(len(self.files))
+                if total > budget]
+
+    def report(self, count=10):
+        """ Lines of the human readable report: the slowest files and phases """
+        lines = ["Slowest files:"]
+        for total, source in self.slowest(count):
+            phases = sorted(self.files[source].items(), key=lambda item: -item[1])[:3]
+            lines.append("\t{0:8.3f}s  {1:s}  ({2:s})".format(
+                total, source,
+                ", ".join("{0:s} {1:.3f}s".format(phase, seconds) for phase, seconds in phases)))
+
+        totals = self.by_phase()
+        overall = sum(totals.values()) or 1.0
+        lines.append("Slowest phases:")
+        for phase, seconds in sorted(totals.items(), key=lambda item: -item[1])[:count]:
+            lines.append("\t{0:8.3f}s  {1:5.1f}%  {2:s}"
+                         .format(seconds, 100 * seconds / overall, phase))
+        return lines
+
+    def save(self, path, budget=None):
+        files = {}
+        for source, timings in self.files.items():
+            files[source] = dict(timings, total=self.total(source))
+
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(json.dumps({
+                'phases': self.by_phase(),
+                'files': files,
+                'budget': budget,
+                'over_budget': [source for _, source in self.over_budget(budget)]
+                if budget is not None else [],
+            }, sort_keys=True, indent=1, ensure_ascii=False))
+
+
+class Timer(object):
+    """ Context manager timing a phase of a `BuildProfile`, if there is one """
+
+    __slots__ = ('profile', 'source', 'phase')
+
+    def __init__(self, profile, source, phase):
+        self.profile = profile
+        self.source = source
+        self.phase = phase
+
+    def __enter__(self):
+        if self.profile is not None:
+            self.profile.start(self.source, self.phase)
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.stop()
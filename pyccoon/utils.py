@@ -1,6 +1,13 @@
 import os
+import re
+import threading
 import time
-from collections import namedtuple
+import traceback
+from collections import namedtuple, OrderedDict, defaultdict
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class SourceFile(namedtuple('SourceFile', 'destination source process prefix')):
@@ -33,6 +40,296 @@ class cached_property(object):
         return attr
 
 
+class SourceRecord(object):
+    """
+    ### Source record
+    Everything a build learns about a single source file: its contents, language and\
+    destination. Each piece is loaded on first use and then shared by all the stages, so that\
+    the file is not read again and again.
+    """
+
+    prefix_size = 1024
+    destination = None
+
+    def __init__(self, source, path, detect_language):
+        """
+        :param source: Path of the file relative to the source folder
+        :param path: Absolute path of the file
+        :param detect_language: Function returning the language of a `SourceRecord`
+        """
+        self.source = source
+        self.path = path
+        self.detect_language = detect_language
+
+    @cached_property
+    def data(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    @cached_property
+    def prefix(self):
+        """ The beginning of the file, enough to tell a binary file from a text one """
+        if 'data' in self.__dict__:
+            return self.data[:self.prefix_size]
+
+        with open(self.path, 'rb') as f:
+            return f.read(self.prefix_size)
+
+    @cached_property
+    def code(self):
+        return self.data.decode('utf8')
+
+    @cached_property
+    def language(self):
+        return self.detect_language(self)
+
+    @cached_property
+    def isfile(self):
+        """ Whether the file exists. Source discovery sets it from the folder listing. """
+        return os.path.isfile(self.path)
+
+    def release(self):
+        """ Forget the contents of the file, but keep everything derived from them """
+        for name in ('data', 'prefix', 'code'):
+            self.__dict__.pop(name, None)
+
+
+class SourceFolder(object):
+    """
+    ### Source tree
+    A folder of the collected sources: the files and subfolders it contains, and the source\
+    that becomes its `index.html`, if any.
+    """
+
+    def __init__(self, path, parent=None):
+        self.path = path
+        self.parent = parent
+        self.name = os.path.basename(path)
+        self.files = OrderedDict()
+        self.folders = OrderedDict()
+        self.index = None
+
+    def walk(self):
+        """ Iterate over this folder and all of its subfolders """
+        yield self
+        for folder in self.folders.values():
+            for subfolder in folder.walk():
+                yield subfolder
+
+
+class SourceTree(object):
+    """
+    The whole tree of the collected sources, built once so that index pages, breadcrumbs and\
+    navigation do not have to search through all the sources or list the folders again.
+    """
+
+    def __init__(self, outdir, sources):
+        """
+        :param outdir: Output folder
+        :param sources: `dict` of `SourceFile`s, by source path
+        """
+        self.outdir = outdir
+        self.sources = sources
+        self.root = SourceFolder('')
+        # Sources of the index pages generated for the folders that have no index file
+        self.generated = set()
+        for sf in sources.values():
+            self.add(sf)
+
+    def folder(self, path, create=False):
+        """ Folder node by its path relative to the source folder, or `None` """
+        folder = self.root
+        for name in path.split(os.sep) if path else []:
+            if name not in folder.folders:
+                if not create:
+                    return None
+                folder.folders[name] = \
+                    SourceFolder(os.path.join(folder.path, name), parent=folder)
+            folder = folder.folders[name]
+        return folder
+
+    def add(self, sf):
+        """ Add or update a `SourceFile`. Static resources from outside of the source folder\
+            are ignored. """
+        if os.path.isabs(sf.source):
+            return
+
+        dirname, filename = os.path.split(os.path.normpath(sf.source))
+        folder = self.folder(dirname, create=True)
+        folder.files[filename] = sf
+        if self.is_index(folder, sf):
+            folder.index = sf
+
+    def remove(self, sf):
+        """ Remove a `SourceFile`. Returns the folders left empty, which are removed as well. """
+        dirname, filename = os.path.split(os.path.normpath(sf.source))
+        folder = self.folder(dirname)
+        if folder is None or folder.files.get(filename) is not sf:
+            return []
+
+        del folder.files[filename]
+        if folder.index is sf:
+            folder.index = None
+
+        removed = []
+        while folder.parent is not None and not folder.files and not folder.folders:
+            del folder.parent.folders[folder.name]
+            removed.append(folder)
+            folder = folder.parent
+        return removed
+
+    def add_index(self, folder, sf):
+        """ Register a generated index page of the `folder`. It is not listed as a file. """
+        folder.index = sf
+        self.generated.add(sf.source)
+
+    def reset_index(self, sf):
+        """ Mark a generated index page to be generated again """
+        folder = self.folder(os.path.dirname(sf.source))
+        if folder is not None and folder.index is sf:
+            folder.index = None
+
+    def is_index(self, folder, sf):
+        return sf.destination == os.path.join(self.outdir, folder.path, "index.html")
+
+    def missing_indexes(self):
+        """ Folders that have no index file """
+        return [folder for folder in self.root.walk() if folder.index is None]
+
+
+class DependencyGraph(object):
+    """
+    ### Dependency graph
+    Which pages have to be regenerated when a source changes: the pages that link to it with\
+    `[[...]]` cross-references, and the index pages that list the folders it is in.
+    """
+
+    def __init__(self):
+        self.links = defaultdict(set)
+        self.listings = defaultdict(set)
+
+    def add_link(self, source, target):
+        self.links[os.path.normpath(target)].add(source)
+
+    def add_listing(self, source, folder):
+        self.listings[folder].add(source)
+
+    def update(self, other):
+        """ Merge another graph in, e.g. the one recorded by a worker process """
+        for target, sources in other.links.items():
+            self.links[target] |= sources
+        for folder, sources in other.listings.items():
+            self.listings[folder] |= sources
+
+    def dependents(self, source, listed=False):
+        """
+        Sources of the pages depending on the `source`.
+
+        :param listed: Whether the `source` was added or removed, which changes the listings\
+            of its folder and, for new or removed folders, of the folders above.
+        """
+        source = os.path.normpath(source)
+        dependents = set(self.links.get(source, ()))
+        if listed:
+            folder = source
+            while folder:
+                folder = os.path.dirname(folder)
+                dependents |= self.listings.get(folder, set())
+        dependents.discard(source)
+        return dependents
+
+
+class PathMatcher(object):
+    """
+    ### Skip and copy patterns
+    The `files.skip` and `files.copy` patterns of the config, each list combined into a single\
+    regular expression, so that a path is searched once rather than once per pattern.
+    """
+
+    backreference_re = re.compile(r'\\\d|\(\?P=')
+
+    def __init__(self, skip=(), copy=()):
+        self.skip = self.combine(skip)
+        self.copy = self.combine(copy)
+
+    @classmethod
+    def combine(cls, patterns):
+        """ `search` function matching wherever any of the `patterns` does """
+        patterns = [getattr(pattern, 'pattern', pattern) for pattern in patterns]
+        if not patterns:
+            return lambda string: None
+
+        # Group numbers change in the combined expression, and patterns with flags of their own
+        # cannot be combined at all: those are searched one by one
+        if not any(cls.backreference_re.search(pattern) for pattern in patterns):
+            try:
+                return re.compile("|".join("(?:{0})".format(p) for p in patterns)).search
+            except re.error:
+                pass
+        regexes = [re.compile(pattern) for pattern in patterns]
+        return lambda string: any(regex.search(string) for regex in regexes)
+
+    def skipped(self, path):
+        return bool(self.skip(path))
+
+    def copied(self, name):
+        return bool(self.copy(name))
+
+
+class FolderEntry(object):
+    """ `os.DirEntry` of the Pythons that have no `os.scandir` """
+
+    def __init__(self, folder, name):
+        self.name = name
+        self.path = os.path.join(folder, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def scandir(folder):
+    """ `list` of the entries of the `folder`, with `os.scandir` wherever it exists """
+    if hasattr(os, 'scandir'):
+        # Listing all the entries closes the iterator, which is not a context manager before 3.6
+        return list(os.scandir(folder))
+    return [FolderEntry(folder, name) for name in os.listdir(folder)]
+
+
+def walk_sources(top, skipped):
+    """
+    `os.walk` that does not descend into the folders for which `skipped(path)` is true. Yields\
+    `(dirpath, files)` with the `os.DirEntry` of every file, in the same order as `os.walk`.
+    """
+    if skipped(top):
+        return
+
+    try:
+        entries = scandir(top)
+    except OSError:
+        return
+
+    files, folders = [], []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        (folders if is_dir else files).append(entry)
+
+    yield top, files
+    for entry in folders:
+        # Symbolic links to folders are not followed, like in `os.walk`
+        if not entry.is_symlink():
+            for result in walk_sources(entry.path, skipped):
+                yield result
+
+
 def shift(array, default):
     """
     Shift items off the front of the `array` until it is empty, then return
@@ -45,6 +342,83 @@ def shift(array, default):
         return default
 
 
+def isplit(pattern, string):
+    """
+    Lazy `re.split`: yield the parts of the `string` separated by the `pattern` one by one.\
+    The pattern must not have groups.
+    """
+    position = 0
+    for match in re.finditer(pattern, string):
+        yield string[position:match.start()]
+        position = match.end()
+    yield string[position:]
+
+
+def isplit_pieces(pattern, pieces):
+    """
+    `isplit` of the text the `pieces` make up, without ever joining them all: a part is yielded\
+    as soon as the separator after it has arrived. The pieces have to end at line boundaries,\
+    and a separator may only span lines with the newlines around it.
+    """
+    pattern = re.compile(pattern)
+    buffer = ''
+    # No separator starts before this position of the buffer
+    start = 0
+    for piece in pieces:
+        buffer += piece
+        position = 0
+        for match in pattern.finditer(buffer, start):
+            # The newlines after the separator may go on in the next piece
+            if match.end() == len(buffer):
+                start = match.start()
+                break
+            yield buffer[position:match.start()]
+            position = match.end()
+        else:
+            # A new separator can only start on the next line, or with the newlines before it
+            start = len(buffer)
+            while start > position and buffer[start - 1] == '\n':
+                start -= 1
+        buffer = buffer[position:]
+        start -= position
+
+    for part in isplit(pattern, buffer):
+        yield part
+
+
+def split_shards(costs, count):
+    """
+    Split the sources into `count` shards of about the same total cost: the most expensive\
+    sources first, each into the shard with the lowest total so far. The same `costs` are always\
+    split the same way.
+
+    :param costs: `dict` of the estimated costs, by source
+    :return: `list` of `count` sets of sources
+    """
+    shards = [set() for _ in range(count)]
+    totals = [0] * count
+    for source in sorted(costs, key=lambda source: (-costs[source], source)):
+        shard = min(range(count), key=lambda i: (totals[i], i))
+        shards[shard].add(source)
+        totals[shard] += costs[source]
+    return shards
+
+
+def commit_time(path):
+    """ Unix time of the last commit of the git repository the `path` is in, or `None` """
+    import subprocess
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'log', '-1', '--format=%ct'],
+                                             cwd=path, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    output = output.strip()
+    return int(output) if output.isdigit() else None
+
+
 def ensure_directory(directory):
     """ ### Ensure directory
         Ensure that the destination directory exists."""
@@ -53,8 +427,70 @@ def ensure_directory(directory):
         os.makedirs(directory)
 
 
-def monitor(path, file_modified, file_changed):
-    """Monitor each source file and re-generate documentation on change."""
+class WatchWorker(object):
+    """
+    ### Watch worker
+    Builds the docs in a background thread, so that the watcher only has to put the changes it\
+    sees into a queue. The changes are collected until none came for `delay` seconds, and the\
+    changed paths (listed once, however many events they had) go to a single build. When new\
+    changes arrive while a build is running, it is cancelled, and the next build starts as soon\
+    as they settle down.
+    """
+
+    def __init__(self, build, delay=0.5):
+        """
+        :param build: Called with a `dict` of the changed paths, telling whether each of them\
+            was created or removed rather than modified, and with a function that tells whether\
+            to cancel the build
+        :param delay: Seconds without changes to wait for before a build
+        """
+        self.build = build
+        self.delay = delay
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """ Cancel the running build, if any, and wait for the thread to finish """
+        self.queue.put(None)
+        self.thread.join()
+
+    def put(self, path, changed=False):
+        """ Report a modified path, or a `changed` one: created, removed or moved """
+        self.queue.put((path, changed))
+
+    def cancelled(self):
+        return not self.queue.empty()
+
+    def run(self):
+        while True:
+            changes = OrderedDict()
+            item = self.queue.get()
+            while item is not None:
+                path, changed = item
+                changes[path] = changes.get(path, False) or changed
+                try:
+                    item = self.queue.get(timeout=self.delay)
+                except queue.Empty:
+                    break
+            if item is None:
+                return
+
+            try:
+                self.build(changes, self.cancelled)
+            except Exception:
+                traceback.print_exc()
+
+
+def monitor(path, build, delay=0.5):
+    """Monitor each source file and re-generate documentation on change.
+
+    :param build: Called by a `WatchWorker` with the changes
+    :param delay: Seconds without changes to wait for before a build
+    """
 
     # The watchdog modules are imported in `main()` but we need to re-import
     # here to bring them into the local namespace.
@@ -62,9 +498,10 @@ def monitor(path, file_modified, file_changed):
     import watchdog.observers
 
     path = os.path.normpath(path)
+    worker = WatchWorker(build, delay=delay)
 
     class RegenerateHandler(watchdog.events.FileSystemEventHandler):
-        """A handler for recompiling files which triggered watchdog events"""
+        """A handler queueing the files which triggered watchdog events"""
 
         def dispatch(self, event):
 
@@ -73,23 +510,15 @@ def monitor(path, file_modified, file_changed):
                     for f in os.path.relpath(event.src_path, path).split(os.sep)]):
                 return
 
-            task = None
             if event.event_type == "modified":
                 if not event.is_directory:
-                    task = file_modified
-                else:
-                    return
-            else:
-                task = file_changed
-
-            if task:
-                print("\n")
-                print("{} \"{}\" was {}, generating documentation...".format(
-                    "Directory" if event.is_directory else "File",
-                    event.src_path,
-                    event.event_type
-                ))
-                task()
+                    worker.put(event.src_path)
+                return
+
+            worker.put(event.src_path, changed=True)
+            # A move is a removal of the old path and a creation of the new one
+            if getattr(event, 'dest_path', None):
+                worker.put(event.dest_path, changed=True)
 
     # Set up an observer which monitors all directories for files given on
     # the command line and notifies the handler defined above.
@@ -98,6 +527,7 @@ def monitor(path, file_modified, file_changed):
     observer.schedule(event_handler, path=path, recursive=True)
 
     # Run the file change monitoring loop until the user hits Ctrl-C.
+    worker.start()
     observer.start()
     try:
         while True:
@@ -105,3 +535,4 @@ def monitor(path, file_modified, file_changed):
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    worker.stop()
@@ -0,0 +1,110 @@
+"""
+## Cross-reference index
+
+Project-wide index of the anchors every page defines (the slugs of the `### headers` in the\
+documentation and the numbered `section-N` anchors) and of the `[[path#anchor]]` links between\
+the pages. Links are only checked at the end of the build, when all the anchors are known, and\
+the broken ones are reported together.
+"""
+
+import json
+import os
+import re
+from collections import defaultdict
+from io import open
+
+from .output import write_file
+
+
+class CrossReferences(object):
+
+    filename = '.pyccoon-xref.json'
+
+    section_anchor_re = re.compile(r'^section-(\d+)$')
+
+    def __init__(self):
+        self.anchors = defaultdict(set)
+        self.sections = {}
+        self.links = defaultdict(set)
+
+    def add_anchor(self, source, anchor):
+        self.anchors[source].add(anchor)
+
+    def set_sections(self, source, count):
+        self.sections[source] = count
+
+    def add_link(self, source, target, anchor=None):
+        self.links[source].add((os.path.normpath(target), anchor or None))
+
+    def forget(self, source):
+        """ Drop everything known about the `source`, before it is rendered again """
+        self.anchors.pop(source, None)
+        self.sections.pop(source, None)
+        self.links.pop(source, None)
+
+    def update(self, other):
+        """ Merge another index in, replacing what is known about the sources it covers """
+        for source in set(other.anchors) | set(other.sections) | set(other.links):
+            self.forget(source)
+        for source, anchors in other.anchors.items():
+            self.anchors[source] |= anchors
+        self.sections.update(other.sections)
+        for source, links in other.links.items():
+            self.links[source] |= links
+
+    def has_anchor(self, source, anchor):
+        match = self.section_anchor_re.match(anchor)
+        if match:
+            return int(match.group(1)) < self.sections.get(source, 0)
+        return anchor in self.anchors.get(source, ())
+
+    def broken(self, sources, linking=None):
+        """
+        Links that point to a missing file or anchor, as `(source, target, anchor)` tuples.
+
+        :param sources: Collection of all the existing sources
+        :param linking: Only check the links of these sources
+        """
+        broken = []
+        for source in sorted(self.links if linking is None else linking):
+            for target, anchor in sorted(self.links.get(source, ()),
+                                         key=lambda link: (link[0], link[1] or '')):
+                if target not in sources:
+                    broken.append((source, target, anchor))
+                elif anchor and target in self.sections and \
+                        not self.has_anchor(target, anchor):
+                    broken.append((source, target, anchor))
+        return broken
+
+    def load(self, path):
+        """ Load the index saved by a previous build, if there is one """
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        for source, page in data.get('pages', {}).items():
+            self.anchors[source] = set(page['anchors'])
+            self.sections[source] = page['sections']
+            self.links[source] = set((target, anchor) for target, anchor in page['links'])
+
+    def save(self, path, destinations):
+        """
+        :param destinations: `dict` of the page destinations (relative to the output folder),\
+            by source path
+        :returns: Whether the file changed
+        """
+        pages = {}
+        for source in sorted(set(self.anchors) | set(self.sections) | set(self.links)):
+            pages[source] = {
+                'destination': destinations.get(source),
+                'anchors': sorted(self.anchors.get(source, ())),
+                'sections': self.sections.get(source, 0),
+                'links': sorted(([target, anchor] for target, anchor in
+                                 self.links.get(source, ())),
+                                key=lambda link: (link[0], link[1] or ''))
+            }
+
+        return write_file(path, json.dumps({'pages': pages}, sort_keys=True, indent=1,
+                                           ensure_ascii=False).encode('utf8'))
@@ -1,10 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
 import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
 import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from pyccoon import resources
+from pyccoon.api import Renderer
+from pyccoon.cache import DiskCache, MemoCache
+from pyccoon.output import OutputFile, write_file
 from pyccoon.pyccoon import Pyccoon
-from pyccoon.utils import SourceFile
+from pyccoon.server import DocumentationServer
+from pyccoon.templates import compile_template
+from pyccoon.xref import CrossReferences
+from pyccoon.languages import default_markdown_extensions, extensions_mapping
+from pyccoon.languages.utils import iterate_sections
+from pyccoon.markdown_extensions import haddock_converter
+from pyccoon.utils import SourceFile, WatchWorker, isplit_pieces
 
 
 class FileTest(unittest.TestCase):
@@ -40,6 +63,9 @@ class FileTest(unittest.TestCase):
         """ Remove created files and verify they do not exist """
         for sf in self.pyccoon.sources.values():
             os.unlink(sf.destination)
+        references = os.path.join(self.folder, CrossReferences.filename)
+        if os.path.exists(references):
+            os.unlink(references)
         assert not os.path.exists(self.output_name), "Dummy output file exists after test"
 
     def check(self, output):
@@ -220,5 +246,780 @@ class RubyLanguage(FileTest):
                         "Indentation splitting does not work")
 
 
+class SimpleTemplate(unittest.TestCase):
+
+    def test(self):
+        """ The simple template engine renders the default template just like pystache """
+        context = {
+            "title": "<Title>",
+            "breadcrumbs": [{"title": "a", "path": "a/index.html"}],
+            "filename": "b.py",
+            "children": [{"title": "c", "path": "c/index.html", "isdir": True}],
+            "sections": [{"num": 0, "docs_html": "<p>Docs</p>", "code_html": "{{ code }}"}],
+            "contents": [{"url": "#x", "basename": "X", "level": "2"}],
+            "contents?": True,
+            "generation_time": "2015-01-01 00:00",
+            "root_path": "..",
+            "project_name": "Project",
+            "mathjax?": False,
+            "docs_only?": False
+        }
+        self.assertEqual(compile_template(resources.read("html"), engine="simple")(context),
+                         compile_template(resources.read("html"), engine="pystache")(context))
+
+
+class SectionPipeline(unittest.TestCase):
+
+    def test(self):
+        """ Steps that splice the sections see the same indices as with a plain list """
+        class Steps(object):
+            @iterate_sections()
+            def merge_pairs(self, sections, i):
+                if sections[i] == sections[i-1]:
+                    sections[i-1:i+1] = [sections[i] * 2]
+                    return i
+
+            @iterate_sections(start=0)
+            def split(self, sections, i):
+                if sections[i] > 1:
+                    sections[i:i+1] = [sections[i] // 2, sections[i] - sections[i] // 2]
+
+        steps = Steps()
+        self.assertEqual(steps.merge_pairs([1, 1, 2, 3, 3, 3, 5]), [4, 6, 3, 5])
+        self.assertEqual(steps.split([3, 1, 4]), [1, 1, 1, 1, 2, 1, 1])
+
+
+class CompiledGrammar(unittest.TestCase):
+
+    def test(self):
+        """ Languages are compiled into immutable grammars that survive pickling """
+        python = extensions_mapping[".py"]
+        grammar = pickle.loads(pickle.dumps(python.grammar))
+        self.assertEqual(grammar.steps, python.grammar.steps)
+        self.assertEqual(grammar.inline_re.pattern, python.grammar.inline_re.pattern)
+        self.assertTrue("split_by_scopes" in grammar.steps)
+        with self.assertRaises(AttributeError):
+            python.grammar.steps = ()
+
+
+class LazyImports(unittest.TestCase):
+
+    def test(self):
+        """ Starting up does not import the renderers nor instantiate the languages, and reads\
+            no resources """
+        script = ("import sys, pyccoon.pyccoon\n"
+                  "from pyccoon import resources\n"
+                  "from pyccoon.languages import extensions_mapping\n"
+                  "heavy = set(['markdown', 'pygments', 'pystache', 'yaml'])\n"
+                  "print(sorted(set(sys.modules) & heavy))\n"
+                  "print(len(extensions_mapping.instances))\n"
+                  "print(len(resources.contents))")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+        self.assertEqual(output.decode('utf8').split(), ['[]', '0', '0'])
+
+        self.assertEqual(resources.css, resources.read("css"))
+        self.assertEqual(resources.default_config, resources.read("default_config"))
+        with self.assertRaises(AttributeError):
+            resources.js
+
+
+class JobsOption(unittest.TestCase):
+
+    def test(self):
+        """ A negative number of jobs is rejected before any work starts """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        folder = tempfile.mkdtemp()
+        try:
+            process = subprocess.Popen([sys.executable, '-m', 'pyccoon.pyccoon', '-j', '-1',
+                                        '-s', folder, '-d', os.path.join(folder, 'docs')],
+                                       cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _, error = process.communicate()
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(process.returncode, 2)
+        self.assertTrue(b"--jobs" in error)
+
+
+class MarkdownEngines(unittest.TestCase):
+
+    docs = [
+        "# Title\n\nSee http://example.com and $x^2$\n",
+        "Term\n:   Definition\n\nTODO: later\n",
+        "```\ncode = 1\n```\n\n| a | b |\n|---|---|\n| 1 | 2 |\n",
+        ":param x: The value\n:return: Nothing\n",
+        "$$\ny = x\n$$\n\n<div>html</div>\n",
+    ]
+
+    def test(self):
+        """ Engines are reused in a thread and replaced after a while, with the same output """
+        import markdown
+
+        expected = [markdown.Markdown(extensions=default_markdown_extensions()).convert(text)
+                    for text in self.docs]
+
+        language = extensions_mapping[".py"]
+        language.__dict__.pop("markdown_engines", None)
+        language.markdown_engine_uses = 3
+        engines, outputs = [], []
+        try:
+            for text in self.docs * 2:
+                outputs.append(language.markdown(text))
+                engines.append(language.markdown_engines.engine)
+        finally:
+            del language.markdown_engine_uses
+        self.assertEqual(outputs, expected * 2)
+        self.assertEqual([len(set(engines[i:i + 3])) for i in range(0, 10, 3)], [1, 1, 1, 1])
+        self.assertEqual(len(set(engines)), 4)
+
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append((language.markdown(self.docs[0]),
+                                         language.markdown_engines.engine)))
+        thread.start()
+        thread.join()
+        self.assertEqual(other[0][0], expected[0])
+        self.assertFalse(other[0][1] in engines)
+
+
+class ProjectTest(unittest.TestCase):
+
+    """
+    Test case that runs Pyccoon over a whole temporary project folder. Subclasses override the\
+    `files` mapping of the project and the options passed to Pyccoon.
+    """
+
+    files = {
+        "__init__.py": "# ## Package\n",
+        "module.py": "# ## Module\ndef f():\n    pass\n",
+        "sub/other.py": "# Other module\nx = 1\n",
+    }
+    options = {}
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.sourcedir = os.path.join(self.folder, "src")
+        self.outdir = os.path.join(self.folder, "docs")
+        for name, contents in self.files.items():
+            self.write(name, contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, contents):
+        path = os.path.join(self.sourcedir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(contents)
+
+    def build(self, **options):
+        opts = {
+            'sourcedir':    self.sourcedir,
+            'outdir':       self.outdir,
+            'config_file':  os.path.join(self.folder, ".pyccoon.yaml"),
+            'verbosity':    0,
+        }
+        opts.update(self.options)
+        opts.update(options)
+        return Pyccoon(opts)
+
+
+class SourceReads(ProjectTest):
+
+    files = dict(ProjectTest.files, **{
+        "tool": "#!/usr/bin/env python\n# ## Tool\nx = 1\n",
+        "notes.md": "# Notes\nSee [[module.py]] and [[sub/other.py]]\n",
+    })
+
+    def test(self):
+        """ Every source is read in full and its language detected once per build """
+        import pyccoon.utils
+
+        reads, detected = [], []
+        sourcedir = self.sourcedir
+
+        class File(object):
+            def __init__(self, path, mode):
+                self.file = open(path, mode)
+                self.source = os.path.relpath(path, sourcedir)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self.file.close()
+
+            def read(self, size=-1):
+                if size < 0:
+                    reads.append(self.source)
+                return self.file.read(size)
+
+        detect_language = Pyccoon.detect_language
+
+        def detect(pyccoon, record):
+            detected.append(record.source)
+            return detect_language(pyccoon, record)
+
+        with mock.patch.object(pyccoon.utils, 'open', File, create=True), \
+                mock.patch.object(Pyccoon, 'detect_language', detect):
+            self.build()
+
+        self.assertEqual(sorted(reads), sorted(self.files))
+        # Generated index pages have no source to detect the language of
+        self.assertEqual(sorted(source for source in detected if source in self.files),
+                         sorted(self.files))
+
+
+class IncrementalBuild(ProjectTest):
+
+    options = {'incremental': True}
+
+    def test(self):
+        """ Incremental build: unchanged files are skipped, removed ones are cleaned up """
+        self.build()
+        module = os.path.join(self.outdir, "module.py.html")
+        other = os.path.join(self.outdir, "sub", "other.py.html")
+        os.utime(module, (0, 0))
+
+        self.write("sub/other.py", "# Changed\nx = 2\n")
+        self.build()
+        self.assertEqual(os.path.getmtime(module), 0, "Unchanged file was regenerated")
+        with open(other) as f:
+            self.assertTrue("Changed" in f.read(), "Changed file was not regenerated")
+
+        os.unlink(os.path.join(self.sourcedir, "module.py"))
+        self.build()
+        self.assertFalse(os.path.exists(module), "Output of a removed file was not cleaned up")
+
+
+class IncrementalLinks(ProjectTest):
+
+    files = {
+        "a.py": "# See [[b.py]]\nx = 1\n",
+        "c.py": "y = 2\n",
+    }
+    options = {'incremental': True}
+
+    def read(self, name):
+        with open(os.path.join(self.outdir, name)) as f:
+            return f.read()
+
+    def test(self):
+        """ Unchanged pages linking to added or removed sources are regenerated """
+        self.build()
+        self.assertTrue('href="b.py"' in self.read("a.py.html"))
+        unrelated = os.path.join(self.outdir, "c.py.html")
+        os.utime(unrelated, (0, 0))
+
+        self.write("b.py", "z = 3\n")
+        self.build()
+        self.assertTrue('href="b.py.html"' in self.read("a.py.html"), "Link was not updated")
+        self.assertEqual(os.path.getmtime(unrelated), 0, "Unrelated page was regenerated")
+
+        os.unlink(os.path.join(self.sourcedir, "b.py"))
+        self.build()
+        self.assertTrue('href="b.py"' in self.read("a.py.html"), "Link was not updated")
+
+
+class IndexPages(ProjectTest):
+
+    files = {
+        "pkg/__init__.py": "# ## Package docs\n",
+        "pkg/sub/module.py": "x = 1\n",
+    }
+
+    def test(self):
+        """ Index pages are generated for folders without one, and only for them """
+        self.build()
+        with open(os.path.join(self.outdir, "pkg", "index.html")) as f:
+            self.assertTrue("Package docs" in f.read(), "Package index was overwritten")
+        with open(os.path.join(self.outdir, "pkg", "sub", "index.html")) as f:
+            self.assertTrue('href="module.py.html"' in f.read(), "Missing navigation")
+        self.assertTrue(os.path.exists(os.path.join(self.outdir, "index.html")))
+
+
+class WatchRegeneration(ProjectTest):
+
+    files = {
+        "__init__.py": "# ## Package\n",
+        "a.py": "# See [[b.py]]\nx = 1\n",
+        "b.py": "y = 2\n",
+    }
+
+    def read(self, name):
+        with open(os.path.join(self.outdir, name)) as f:
+            return f.read()
+
+    def test(self):
+        """ Watch mode regenerates only the changed sources and the pages depending on them """
+        pyccoon = self.build()
+        self.assertTrue('href="b.py.html"' in self.read("a.py.html"))
+
+        os.utime(os.path.join(self.outdir, "index.html"), (0, 0))
+        self.write("b.py", "y = 3\n")
+        pyccoon.file_modified(os.path.join(self.sourcedir, "b.py"))
+        self.assertTrue("3" in self.read("b.py.html"))
+        self.assertEqual(os.path.getmtime(os.path.join(self.outdir, "index.html")), 0,
+                         "Unrelated page was regenerated")
+
+        os.unlink(os.path.join(self.sourcedir, "b.py"))
+        pyccoon.file_changed(os.path.join(self.sourcedir, "b.py"))
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, "b.py.html")))
+        self.assertFalse("b.py.html" in self.read("a.py.html"), "Link was not updated")
+        self.assertFalse("b.py.html" in self.read("index.html"), "Listing was not updated")
+
+        self.write("c/d.py", "z = 4\n")
+        pyccoon.file_changed(os.path.join(self.sourcedir, "c"))
+        self.assertTrue(os.path.exists(os.path.join(self.outdir, "c", "d.py.html")))
+        self.assertTrue(os.path.exists(os.path.join(self.outdir, "c", "index.html")))
+        self.assertTrue('href="c/index.html"' in self.read("index.html"))
+
+
+class WatchBatches(WatchRegeneration):
+
+    def test(self):
+        """ Changes are built in batches, and new ones cancel the running build """
+        batches = []
+        started = threading.Event()
+
+        def build(changes, cancelled):
+            batches.append(changes)
+            started.set()
+            # The first build runs until it is cancelled
+            while len(batches) == 1 and not cancelled():
+                time.sleep(0.01)
+
+        worker = WatchWorker(build, delay=0.05)
+        worker.start()
+        for path in ["a.py", "b.py", "a.py"]:
+            worker.put(path)
+        worker.put("b.py", changed=True)
+        started.wait(5)
+        worker.put("c.py")
+        time.sleep(0.3)
+        worker.stop()
+        self.assertEqual(batches, [{"a.py": False, "b.py": True}, {"c.py": False}])
+
+        # The sources a cancelled build leaves out are built with the next batch
+        pyccoon = self.build()
+        for name in self.files:
+            self.write(name, "# Changed\n")
+        pyccoon.rebuild(dict((os.path.join(self.sourcedir, name), False) for name in self.files),
+                        cancelled=lambda: True)
+        self.assertEqual(len(pyccoon.unfinished), len(self.files) - 1)
+        pyccoon.rebuild({})
+        self.assertEqual(pyccoon.unfinished, set())
+        for name in self.files:
+            self.assertTrue("Changed" in self.read(pyccoon.sources[name].destination))
+
+
+class CrossReferenceIndex(ProjectTest):
+
+    files = {
+        "a.py": "# ## Usage\n# See [[b.py#setup]], [[b.py#missing]] and [[c.py]],\n"
+                "# but not `[[d.py]]`\nx = 1\n",
+        "b.py": "# ## Setup\ny = 2\n",
+    }
+
+    def test(self):
+        """ Links to missing files and anchors are found once all the pages are rendered """
+        pyccoon = self.build()
+        self.assertTrue("usage" in pyccoon.references.anchors["a.py"])
+        self.assertEqual(pyccoon.references.broken(pyccoon.sources),
+                         [("a.py", "b.py", "missing"), ("a.py", "c.py", None)])
+
+
+class BuildProfiling(ProjectTest):
+
+    def test(self):
+        """ Profiling records the phases of every file and reports the files over the budget """
+        report = os.path.join(self.folder, "profile.json")
+        pyccoon = self.build(profile=report, budget=0.0)
+        self.assertTrue(pyccoon.profiler.files["module.py"]["parse"] >= 0)
+        self.assertTrue("module.py" in [source for _, source in pyccoon.over_budget])
+        with open(report) as f:
+            self.assertTrue("module.py" in json.load(f)["over_budget"])
+
+
+class HighlightCache(ProjectTest):
+
+    def test(self):
+        """ Highlighted code is reused between builds, and the cache stays within its limit """
+        cache_dir = os.path.join(self.folder, "cache")
+        self.build(cache_dir=cache_dir)
+        with open(os.path.join(self.outdir, "module.py.html")) as f:
+            page = f.read()
+
+        shutil.rmtree(self.outdir)
+        pyccoon = self.build(cache_dir=cache_dir)
+        self.assertEqual(pyccoon.highlight_cache.misses, 0)
+        with open(os.path.join(self.outdir, "module.py.html")) as f:
+            self.assertEqual(f.read(), page)
+
+        # The highlighted code and the docs stay within a single limit together
+        limited = os.path.join(self.folder, "limited")
+        self.build(cache_dir=limited, cache_size=100.0 / 1024 / 1024)
+        self.assertTrue(DiskCache(limited).measure() <= 100)
+
+        cache = DiskCache(os.path.join(self.folder, "lru"), max_size=130)
+        for key in "abc":
+            cache.set((key,), key * 40)
+            os.utime(cache.path((key,)), (0, ord(key)))
+        cache.get(("a",))
+        cache.set(("d",), "d" * 40)
+        self.assertEqual([cache.get((key,)) is not None for key in "abcd"],
+                         [True, False, False, True])
+
+
+class DocsCache(ProjectTest):
+
+    files = {
+        "a.py": "# Licensed under the *MIT* license\nx = 1\n# ## Part A\ny = 2\n",
+        "b.py": "# Licensed under the *MIT* license\nx = 1\n# ## Part B\ny = 2\n",
+    }
+
+    def test(self):
+        """ Identical docs are converted once, and the conversions can be kept between builds """
+        cache_dir = os.path.join(self.folder, "cache")
+        pyccoon = self.build(cache_dir=cache_dir)
+        self.assertEqual((pyccoon.docs_cache.hits, pyccoon.docs_cache.misses), (1, 3))
+        self.assertTrue("part-b" in pyccoon.references.anchors["b.py"])
+
+        pyccoon = self.build(cache_dir=cache_dir)
+        self.assertEqual(pyccoon.docs_cache.misses, 0)
+
+
+class LanguageDetection(ProjectTest):
+
+    files = {
+        "tool": "#!/usr/bin/env python3\n# ## Tool\nx = 1\n",
+        "script": "// vim: set ft=javascript:\nvar x = 1;\n",
+        "Rakefile": "# Tasks\ntask :build do\nend\n",
+        "NOTES": "Some notes\n",
+        "main.go": "import os\nimport sys\n",
+        "app.ts": "import os\n",
+    }
+    options = {'incremental': True}
+
+    def test(self):
+        """ Files without an extension are recognized by their name, `#!` line or modeline,\
+            and the next build does not detect them again. Files in the languages Pygments\
+            knows and Pyccoon does not are copied, whatever they look like. """
+        self.build()
+        for name in ("tool.html", "script.html", "Rakefile.html", "NOTES"):
+            self.assertTrue(os.path.exists(os.path.join(self.outdir, name)), name)
+        for name in ("main.go", "app.ts"):
+            self.assertFalse(os.path.exists(os.path.join(self.outdir, name + ".html")), name)
+            with open(os.path.join(self.outdir, name)) as f:
+                self.assertEqual(f.read(), self.files[name])
+
+        with mock.patch('pyccoon.languages.language_from_shebang') as detect:
+            pyccoon = self.build()
+        self.assertEqual(detect.call_count, 0)
+        self.assertEqual(pyccoon.get_language("tool").name, "Python")
+
+
+class SourceDiscovery(ProjectTest):
+
+    files = {
+        "module.py": "# Module\nx = 1\n",
+        "vendor.py": "# Vendored\nx = 1\n",
+        "data.py": "# Data\nx = 1\n",
+        "node_modules/lib/index.js": "// Library\nvar x = 1;\n",
+    }
+
+    def test(self):
+        """ Skipped folders are not even listed, skip and copy patterns still apply to files """
+        with open(os.path.join(self.folder, ".pyccoon.yaml"), "w") as f:
+            f.write("files:\n  skip: ['node_modules', '^vendor']\n  copy: ['(?i)^DATA']\n")
+
+        with mock.patch('os.scandir', side_effect=os.scandir) as scandir:
+            pyccoon = self.build()
+        listed = [call[0][0] for call in scandir.call_args_list]
+        self.assertFalse([path for path in listed if 'node_modules' in path])
+        self.assertEqual(sorted(source for source in pyccoon.sources if not os.path.isabs(source)),
+                         ["data.py", "index.html", "module.py"])
+        self.assertFalse(pyccoon.sources["data.py"].process)
+
+        # Without `os.scandir`, the folders are listed with `os.listdir`
+        scandir = os.scandir
+        del os.scandir
+        try:
+            self.assertEqual(sorted(self.build().sources), sorted(pyccoon.sources))
+        finally:
+            os.scandir = scandir
+
+
+class StreamedPages(ProjectTest):
+
+    def test(self):
+        """ Pages whose sections are rendered one by one as they are written are the same as\
+            the pages rendered whole, with both template engines """
+        pyccoon = self.build()
+        language = pyccoon.get_language("module.py")
+        code = "# ## Module\n# With `{{code}}`\nx = '{{'\n\n# ### The *next* part\ny = 1\n\n" * 50
+        path = os.path.join(self.folder, "page.html")
+        for engine in ("pystache", "simple"):
+            pyccoon.page_template = compile_template(resources.read("html"), engine=engine)
+            if engine == "pystache":
+                self.assertIsNotNone(pyccoon.page_template.parts)
+            with mock.patch.object(type(language), "highlight_chunk_size", 1):
+                pyccoon.write_html(path, "module.py", pyccoon.stream("module.py", code, language))
+            sections = pyccoon.document("module.py", code, language)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(),
+                                 pyccoon.generate_html("module.py", sections).encode("utf8"))
+
+        # The newlines around a separator may come in the next piece
+        self.assertEqual(list(isplit_pieces(r"\n*-\n*", ["a\n-\n", "\nb\n"])), ["a", "b\n"])
+
+
+class UnchangedOutputs(ProjectTest):
+
+    def test(self):
+        """ Rebuilding replaces only the output files whose contents changed """
+        self.build()
+        outputs = [os.path.join(dirpath, name)
+                   for dirpath, _, names in os.walk(self.outdir) for name in names]
+        for path in outputs:
+            os.utime(path, (0, 0))
+
+        self.write("sub/other.py", "# Changed\nx = 2\n")
+        pyccoon = self.build()
+        changed = sorted(os.path.relpath(path, self.outdir) for path in outputs
+                         if os.path.getmtime(path) != 0)
+        self.assertEqual(changed, [os.path.join("sub", "other.py.html")])
+        self.assertEqual((pyccoon.outputs_written, pyccoon.outputs_unchanged),
+                         (1, len(outputs) - 1))
+
+        # The existing file is compared a block at a time
+        path = os.path.join(self.folder, "large")
+        data = b"x" * (3 * OutputFile.chunk_size)
+        write_file(path, data)
+        with mock.patch.object(OutputFile, "chunk_size", 10):
+            with OutputFile(path) as f:
+                with mock.patch.object(f.existing, "read", wraps=f.existing.read) as read:
+                    f.write(data[:-1] + b"y")
+        self.assertTrue(f.changed)
+        self.assertLessEqual(max(call[0][0] for call in read.call_args_list), 10)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), data[:-1] + b"y")
+        os.unlink(path)
+
+        path = os.path.join(self.folder, "file")
+        for data in (b"abcdef", b"abc", b"abcxyz", b""):
+            write_file(path, data)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+        try:
+            with OutputFile(path) as f:
+                f.write(b"partial")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(sorted(os.listdir(self.folder)), ["docs", "file", "src"])
+        self.assertEqual(os.path.getsize(path), 0)
+
+
+class ReproducibleBuild(ProjectTest):
+
+    def outputs(self, outdir):
+        outputs = {}
+        for dirpath, _, names in os.walk(outdir):
+            for name in names:
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    outputs[os.path.relpath(os.path.join(dirpath, name), outdir)] = f.read()
+        return outputs
+
+    def test(self):
+        """ Building the same sources twice gives byte-identical output """
+        with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1500000000'}):
+            self.build(reproducible=True)
+
+            # Create the files again in the reverse order and build from another folder
+            for name in sorted(self.files, reverse=True):
+                os.unlink(os.path.join(self.sourcedir, name))
+                self.write(name, self.files[name])
+            cwd = os.getcwd()
+            os.chdir(self.sourcedir)
+            try:
+                self.build(reproducible=True, outdir=os.path.join(self.folder, "again"))
+            finally:
+                os.chdir(cwd)
+
+        first = self.outputs(self.outdir)
+        self.assertEqual(first, self.outputs(os.path.join(self.folder, "again")))
+        self.assertTrue(b"2017-07-14 02:40" in first["module.py.html"])
+
+
+class ParallelBuild(ReproducibleBuild):
+
+    files = dict(ProjectTest.files, **{
+        "notes.md": "# Notes\nSee [[module.py#module]]\n",
+        "sub/image.png": "PNG",
+    })
+
+    def test(self):
+        """ Worker processes give the same output as a serial build, failing files included """
+        with open(os.path.join(self.sourcedir, "broken.py"), "wb") as f:
+            f.write(b"# Not UTF-8: \xff\nx = 1\n")
+
+        with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1500000000'}):
+            self.build()
+            parallel = os.path.join(self.folder, "parallel")
+            self.build(outdir=parallel, jobs=2)
+
+        outputs = self.outputs(self.outdir)
+        self.assertFalse("broken.py.html" in outputs)
+        self.assertEqual(outputs, self.outputs(parallel))
+
+        # Workers that cannot start fail the build instead of being restarted forever
+        pyccoon = Pyccoon(dict(sourcedir=self.sourcedir, outdir=parallel, verbosity=0, jobs=2,
+                               config_file=os.path.join(self.folder, ".pyccoon.yaml")),
+                          process=False)
+        with mock.patch.object(Pyccoon, "init_config", side_effect=IOError("no config")):
+            self.assertRaises(RuntimeError, pyccoon.process)
+
+
+class ShardedBuild(ReproducibleBuild):
+
+    files = dict(ProjectTest.files, **{
+        "notes.md": "# Notes\nSee [[module.py#module]]\n",
+        "sub/deep/code.js": "// Code\nvar x = 1;\n",
+        "sub/image.png": "PNG",
+    })
+
+    def test(self):
+        """ Shards render disjoint parts of the sources, merged they equal a single build """
+        with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1500000000'}):
+            self.build()
+            shards = [os.path.join(self.folder, "shard{0:d}".format(i)) for i in (1, 2)]
+            for i, shard in enumerate(shards):
+                self.build(outdir=shard, shard=(i + 1, 2))
+            merged = os.path.join(self.folder, "merged")
+            pyccoon = Pyccoon(dict(sourcedir=self.sourcedir, outdir=merged, verbosity=0,
+                                   config_file=os.path.join(self.folder, ".pyccoon.yaml")),
+                              process=False)
+            pyccoon.merge(shards)
+
+        parts = [set(self.outputs(shard)) - set([".pyccoon-xref.json"]) for shard in shards]
+        self.assertTrue(parts[0] and parts[1] and not parts[0] & parts[1])
+        self.assertEqual(pyccoon.references.broken(pyccoon.sources), [])
+
+        self.assertEqual(self.outputs(merged), self.outputs(self.outdir))
+
+
+class HaddockBatch(ProjectTest):
+
+    files = {
+        "module.hs": "-- | First /function/\nf x = x\n\n-- | Second\ng x = x\n\n"
+                     "-- | Third\nh x = x\n",
+    }
+
+    def test(self):
+        """ The Haddock comments of a file are converted by a single pandoc run, into the same\
+            HTML as one run per comment """
+        calls = []
+
+        def convert(text, to, format=None):
+            calls.append(text)
+            return "".join("<p>{0}</p>\n".format(paragraph.strip())
+                           for paragraph in text.split("\n\n"))
+
+        pypandoc = types.ModuleType("pypandoc")
+        pypandoc.convert = convert
+        pypandoc.get_pandoc_version = lambda: "2.5"
+        pages = []
+        with mock.patch.dict(sys.modules, {"pypandoc": pypandoc}):
+            for batch in (True, False):
+                haddock_converter.results = MemoCache()
+                if batch:
+                    self.build()
+                else:
+                    with mock.patch.object(haddock_converter, "convert_many"):
+                        self.build()
+                with open(os.path.join(self.outdir, "module.hs.html")) as f:
+                    pages.append(f.read())
+            haskell = type(extensions_mapping[".hs"])
+            self.assertTrue("pandoc 2.5" in haskell().markdown_signature)
+
+        self.assertEqual(len(calls), 1 + 3)
+        self.assertTrue("<p>Second</p>" in pages[0] and "PYCCOON" not in pages[0])
+        self.assertEqual(pages[0], pages[1])
+        self.assertTrue("pandoc unavailable" in haskell().markdown_signature)
+
+
+class ServedDocumentation(ProjectTest):
+
+    def test(self):
+        """ Pages are rendered on request, and again only when their source changes """
+        pyccoon = Pyccoon(dict(sourcedir=self.sourcedir, outdir=self.outdir, verbosity=0,
+                               config_file=os.path.join(self.folder, ".pyccoon.yaml")),
+                          process=False)
+        server = DocumentationServer(pyccoon)
+
+        self.assertEqual(server.get("/module.py.html")[2], "rendered")
+        self.assertEqual(server.get("/module.py.html")[2], "cached")
+        self.write("module.py", "# ## Changed\n")
+        page, content_type, origin = server.get("/module.py.html")
+        self.assertEqual((content_type, origin), ("text/html; charset=utf-8", "rendered"))
+        self.assertTrue(b'Changed' in page)
+
+        self.assertTrue(b'other.py' in server.get("/sub/")[0])
+        self.assertEqual(server.get("/pyccoon.css")[1:], ("text/css", "memory"))
+        self.assertTrue(server.folder("sub"))
+        self.assertEqual(server.get("/missing.html"), None)
+        self.assertFalse(os.path.exists(self.outdir))
+
+        cache = MemoCache(max_size=10)
+        for key in "abc":
+            cache.set(key, "1234")
+        self.assertEqual((cache.get("a"), cache.get("c"), cache.size), (None, "1234", 8))
+
+
+class InProcessRendering(unittest.TestCase):
+
+    code = '# ## Module\n# See [[sub/other.py#other]]\ndef f():\n    pass\n'
+
+    def test(self):
+        """ Pages rendered concurrently are the same, and no files are written """
+        folder = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            renderer = Renderer(project_name="Example")
+            pages = []
+
+            def render():
+                for _ in range(5):
+                    pages.append(renderer.page(self.code, path="pkg/module.py"))
+
+            threads = [threading.Thread(target=render) for _ in range(4)]
+            with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1500000000'}):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(os.listdir(folder), [])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(folder)
+
+        self.assertEqual(len(pages), 20)
+        self.assertEqual(len(set(pages)), 1)
+        self.assertTrue('href="../sub/other.py.html#other"' in pages[0])
+        self.assertTrue("<title>Example: pkg/module.py</title>" in pages[0])
+        self.assertTrue("2017-07-14 02:40" in pages[0])
+
+        # Every page is dated by the time it is rendered
+        with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '0'}):
+            self.assertTrue("1970-01-01 00:00" in renderer.page(self.code, path="module.py"))
+
+        sections = renderer.sections("a = 1\n", language="Python")
+        self.assertEqual(sections[0]["docs_html"], "")
+        self.assertRaises(ValueError, renderer.sections, "a = 1\n")
+
+
 if __name__ == '__main__':
     unittest.main()